@@ -1,16 +1,32 @@
 # coding: utf-8
 import os
 import sys
+import glob
+import hashlib
+import itertools
+import shutil
+import tempfile
 
 import cv2
 import pandas as pd
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
 from logging import getLogger
 
+import indicator_utils
+
 
 logger = getLogger("__main__").getChild("dataloader")
 
+# Increment when format of cached map arrays changes
+MAP_CACHE_VERSION = 2
+# Increment when format of cached point arrays changes
+POINT_CACHE_VERSION = 2
+# Increment when format or contents of ground truth index change
+GROUND_TRUTH_INDEX_VERSION = 1
+
 
 def config(track, base_dname, config_file='config.ini'):
     '''
@@ -97,8 +113,8 @@ def map_image(base_dname, map_image_fname):
     
     Returns
     -------
-    bitmap : ndarray of int
-        bitmap data 
+    bitmap : ndarray of uint8
+        bitmap data, 1 byte per pixel
     '''
 
     map_image_path = os.path.join(base_dname, map_image_fname)
@@ -107,12 +123,114 @@ def map_image(base_dname, map_image_fname):
     map_img = cv2.imread(map_image_path, cv2.IMREAD_GRAYSCALE)
     
     # Value 1 is obstacle 
-    bitmap = np.where(map_img==255, 0, 1)
+    bitmap = (map_img != 255).astype(np.uint8)
     logger.debug('map image load complete! image shape:{}'.format(bitmap.shape))
 
     return bitmap 
 
-def load_point(base_dname, point_fname):
+def file_hash(file_paths):
+    '''
+    Hash contents of files, missing file is hashed as absent
+
+    Parameters
+    ----------
+    file_paths : list of str
+
+    Returns
+    -------
+    file_hash : str
+    '''
+    hash_md5 = hashlib.md5()
+    for file_path in file_paths:
+        hash_md5.update(os.path.basename(file_path).encode('utf-8'))
+        if not os.path.exists(file_path):
+            hash_md5.update(b'absent')
+            continue
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hash_md5.update(chunk)
+    return hash_md5.hexdigest()
+
+def replace_file(file_path, write_function):
+    '''
+    Write file through temporary file of unique name in same directory and rename it to file_path,
+    so processes sharing cache directory never read or write partially written file
+
+    Parameters
+    ----------
+    file_path : str
+    write_function : callable
+        writes contents to binary file object given as argument
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=os.path.basename(file_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_function(f)
+        # mkstemp creates file readable only by owner, cache may be shared by users
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def map_artifacts(base_dname, map_image_fname, map_size_fname, area_fname, cache_dname=None):
+    '''
+    Load map bitmap and map-derived arrays, using on-disk cache if cache_dname is set
+    Cache entry is named by path of map image and contents hash of map image, map size and area files, 
+    entries of old contents are removed when any of them changes
+
+    Parameters
+    ----------
+    base_dname : str
+    map_image_fname : str
+    map_size_fname : str
+    area_fname : str
+    cache_dname : str
+        cache directory, cache is not used if None
+
+    Returns
+    -------
+    bitmap : ndarray of uint8
+        bitmap data, memory-mapped if cache_dname is set so pixels are paged in on access
+    obstacle_mask : ndarray of bool
+        result of indicator_utils.obstacle_interior_mask
+    '''
+    if cache_dname is None:
+        bitmap = map_image(base_dname, map_image_fname)
+        return bitmap, indicator_utils.obstacle_interior_mask(bitmap)
+
+    cache_key = file_hash([os.path.join(base_dname, fname) for fname in [map_image_fname, map_size_fname, area_fname]])
+    cache_key = '{}_{}'.format(MAP_CACHE_VERSION, cache_key)
+
+    map_cache_basedir = os.path.join(cache_dname, 'map')
+    path_key = hashlib.md5(os.path.abspath(os.path.join(base_dname, map_image_fname)).encode('utf-8')).hexdigest()
+    map_cache_dname = os.path.join(map_cache_basedir, '{}_{}'.format(path_key, cache_key))
+    key_path = os.path.join(map_cache_dname, 'cache_key.txt')
+    artifact_paths = {name: os.path.join(map_cache_dname, '{}.npy'.format(name)) for name in ['bitmap', 'obstacle_mask']}
+
+    if os.path.exists(key_path) and all(os.path.exists(path) for path in artifact_paths.values()):
+        logger.debug('Loading map cache: {}'.format(map_cache_dname))
+        return tuple(np.load(artifact_paths[name], mmap_mode='r') for name in ['bitmap', 'obstacle_mask'])
+
+    for stale_dname in glob.glob(os.path.join(map_cache_basedir, '{}_*'.format(path_key))):
+        if stale_dname != map_cache_dname:
+            logger.debug('Map cache is stale: {}'.format(stale_dname))
+            # Another process may remove same stale entry
+            shutil.rmtree(stale_dname, ignore_errors=True)
+
+    # Rebuild cache, key file is written last so incomplete cache is never used
+    bitmap = map_image(base_dname, map_image_fname)
+    obstacle_mask = indicator_utils.obstacle_interior_mask(bitmap)
+
+    os.makedirs(map_cache_dname, exist_ok=True)
+    for name, artifact in [('bitmap', bitmap), ('obstacle_mask', obstacle_mask)]:
+        replace_file(artifact_paths[name], lambda f: np.save(f, artifact))
+    replace_file(key_path, lambda f: f.write(cache_key.encode('utf-8')))
+    logger.debug('Map cache is saved at {}'.format(map_cache_dname))
+
+    return tuple(np.load(artifact_paths[name], mmap_mode='r') for name in ['bitmap', 'obstacle_mask'])
+
+def load_point(base_dname, point_fname, cache_dname=None):
     '''
     Load point data file
 
@@ -120,6 +238,8 @@ def load_point(base_dname, point_fname):
     ----------
     base_dname : str
     point_fname : str
+    cache_dname : str
+        cache directory of binary point data, text file is parsed every time if None
     
     Returns
     -------
@@ -129,6 +249,9 @@ def load_point(base_dname, point_fname):
     point_path = os.path.join(base_dname, point_fname)
     logger.debug('Loading point data: {}'.format(point_path))
 
+    if cache_dname is not None and os.path.exists(point_path):
+        return load_point_cache(point_path, cache_dname)
+
     try:
         point = pd.read_csv(point_path, names=['unixtime', 'x_position_m', 'y_position_m'])
     except FileNotFoundError:
@@ -140,6 +263,132 @@ def load_point(base_dname, point_fname):
     
     return point
 
+def load_point_cache(point_path, cache_dname):
+    '''
+    Load point data file through binary cache
+    Text file is converted to .npy once, later loads are memory-mapped.
+    Columns are kept in dtypes parsed by read_csv, points with integer column are saved as record array
+    and copied at load, others are saved as float64 array and not copied.
+    Cache is invalidated when size or modified time of text file changes
+
+    Parameters
+    ----------
+    point_path : str
+    cache_dname : str
+
+    Returns
+    -------
+    point : DataFrame
+        columns = ['unixtime', 'x_position_m', 'y_position_m'], read-only
+    '''
+    point_cache_dname = os.path.join(cache_dname, 'point')
+    os.makedirs(point_cache_dname, exist_ok=True)
+
+    point_stat = os.stat(point_path)
+    path_key = hashlib.md5(os.path.abspath(point_path).encode('utf-8')).hexdigest()
+    cache_path = os.path.join(point_cache_dname, '{}_{}_{}_{}.npy'.format(path_key, point_stat.st_size, point_stat.st_mtime_ns,
+                                                                         POINT_CACHE_VERSION))
+
+    if not os.path.exists(cache_path):
+        for stale_path in glob.glob(os.path.join(point_cache_dname, '{}_*.npy'.format(path_key))):
+            # Another process may remove same stale file
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
+
+        point = pd.read_csv(point_path, names=['unixtime', 'x_position_m', 'y_position_m'])
+        if all(dtype == np.float64 for dtype in point.dtypes):
+            point_array = np.ascontiguousarray(point.values, dtype=np.float64)
+        else:
+            point_array = point.to_records(index=False)
+        replace_file(cache_path, lambda f: np.save(f, point_array))
+        logger.debug('Point data cache is saved at {}'.format(cache_path))
+
+    point_array = np.load(cache_path, mmap_mode='r')
+    if point_array.dtype.names is None:
+        point = pd.DataFrame(point_array, columns=['unixtime', 'x_position_m', 'y_position_m'], copy=False)
+    else:
+        point = pd.DataFrame({column: point_array[column] for column in point_array.dtype.names})
+
+    logger.debug('Point data cache load complete! columns:{}, shape:{}'.\
+        format(point.columns, point.shape))
+
+    return point
+
+def publish_arrays(arrays, publish_dname):
+    '''
+    Publish arrays as .npy files so that other processes can memory-map them read-only
+    Array which is already memory-mapped from .npy file is published without copy
+
+    Parameters
+    ----------
+    arrays : dictionary
+        name -> ndarray
+    publish_dname : str
+
+    Returns
+    -------
+    array_paths : dictionary
+        name -> .npy file path
+    '''
+    array_paths = dict()
+    for name, array in arrays.items():
+        if isinstance(array, np.memmap) and str(array.filename).endswith('.npy') \
+                and np.load(array.filename, mmap_mode='r').shape == array.shape:
+            array_paths[name] = str(array.filename)
+            continue
+
+        array_path = os.path.join(publish_dname, '{}.npy'.format(name))
+        np.save(array_path, np.ascontiguousarray(array))
+        array_paths[name] = array_path
+    logger.debug('{} arrays are published at {}'.format(len(array_paths), publish_dname))
+    return array_paths
+
+def attach_arrays(array_paths):
+    '''
+    Attach arrays published by publish_arrays
+
+    Parameters
+    ----------
+    array_paths : dictionary
+        name -> .npy file path
+
+    Returns
+    -------
+    arrays : dictionary
+        name -> read-only memory-mapped ndarray
+    '''
+    return {name: np.load(array_path, mmap_mode='r') for name, array_path in array_paths.items()}
+
+def prefetch(load_function, items, depth):
+    '''
+    Load items on background thread ahead of consumer
+    At most depth items are loaded or loading besides item being consumed
+
+    Parameters
+    ----------
+    load_function : callable
+        function to load one item
+    items : list
+    depth : int
+        number of items to load ahead
+
+    Yields
+    ------
+    item : object
+    future : Future
+        result of load_function(item), exception is raised by future.result()
+    '''
+    item_iter = iter(items)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        futures = deque((item, executor.submit(load_function, item)) for item in itertools.islice(item_iter, depth))
+        while futures:
+            item, future = futures.popleft()
+            for next_item in itertools.islice(item_iter, 1):
+                futures.append((next_item, executor.submit(load_function, next_item)))
+            yield item, future
+
 def ALIP_info(base_dname, ALIP_info_fname):
     '''
     Load true ALIP info file
@@ -282,6 +531,63 @@ def drop_ans_duplicated_with_ref(ans_point, ref_point):
 
     return ans_duplicated_ref
 
+def partition_evaluation_data_ALIP(evaluation_point, ALIP_info, return_interval_id=False):
+    '''
+    Partition data into out of ALIP and between ALIP in one pass
+    ALIP periods are sorted once and each point is classified by binary search
+
+    Parameters
+    ----------
+    evaluation_point: DataFrame
+        DataFrame columns = ['unixtime', 'x_position_m', 'y_position_m']
+    ALIP_info : DataFrame
+        ALIP period time information
+    return_interval_id : boolean
+        return ALIP_info row number which each point belongs to or not
+
+    Returns
+    -------
+    eval_point_ALAP : DataFrame
+        evaluation point out of ALIP period
+    eval_point_ALIP : DataFrame
+        evaluation point between ALIP period
+    interval_id : Series of int
+        ALIP_info row number of each evaluation point, -1 if out of ALIP period.
+        Only returned when return_interval_id is True
+    '''
+    ALIP_start = ALIP_info['ALIP_start'].values.astype(float)
+    ALIP_end = ALIP_info['ALIP_end'].values.astype(float)
+    ALIP_row = np.flatnonzero(~(np.isnan(ALIP_start) | np.isnan(ALIP_end)))
+
+    unixtime = evaluation_point['unixtime'].values.astype(float)
+    interval_id = np.full(len(unixtime), -1, dtype=int)
+
+    if len(ALIP_row) > 0:
+        # Sort periods by start time, overlapping periods are covered by running max of end time
+        ALIP_row = ALIP_row[np.argsort(ALIP_start[ALIP_row], kind='mergesort')]
+        sorted_start = ALIP_start[ALIP_row]
+        sorted_end = ALIP_end[ALIP_row]
+        cover_pos = np.arange(len(ALIP_row))
+        cover_pos[1:] = np.where(np.diff(np.maximum.accumulate(sorted_end)) > 0, cover_pos[1:], 0)
+        cover_pos = np.maximum.accumulate(cover_pos)
+
+        # Last period which starts at or before unixtime
+        period_pos = np.searchsorted(sorted_start, unixtime, side='right') - 1
+        has_period = period_pos >= 0
+        cover = cover_pos[np.maximum(period_pos, 0)]
+        is_ALIP = has_period & (unixtime <= sorted_end[cover])
+        interval_id[is_ALIP] = ALIP_row[cover[is_ALIP]]
+
+    is_ALIP = interval_id >= 0
+    eval_point_ALAP = evaluation_point[~is_ALIP]
+    eval_point_ALIP = evaluation_point[is_ALIP]
+    logger.debug('evaluation point partition by ALIP period, ALAP:{}, ALIP:{}'.\
+            format(eval_point_ALAP.shape, eval_point_ALIP.shape))
+
+    if return_interval_id:
+        return eval_point_ALAP, eval_point_ALIP, pd.Series(interval_id, index=evaluation_point.index)
+    return eval_point_ALAP, eval_point_ALIP
+
 def filter_evaluation_data_ALIP(evaluation_point, ALIP_info, ALIP_flag):
 
     '''
@@ -301,26 +607,113 @@ def filter_evaluation_data_ALIP(evaluation_point, ALIP_info, ALIP_flag):
     eval_point : DataFrame
         evaluation point for indicator
     '''
-    # Check weather unixtime is between start and end time of ALIP_info
-    def is_unixtime_between_ALIP(x):
-        for ALIP_start, ALIP_end in zip(ALIP_info['ALIP_start'].values, ALIP_info['ALIP_end'].values):
-            if ALIP_start<= x <=ALIP_end:
-                return True
-        return False
-    
+    eval_point_ALAP, eval_point_ALIP = partition_evaluation_data_ALIP(evaluation_point, ALIP_info)
+
     if ALIP_flag:
-        # Boolean array
-        is_unixtime_between_ALIPinfo = evaluation_point['unixtime'].apply(lambda x:is_unixtime_between_ALIP(x))
-        eval_point = evaluation_point[is_unixtime_between_ALIPinfo]
+        eval_point = eval_point_ALIP
         logger.debug('evaluation point BETWEEN ALIP period is selected')
 
     else:
-        is_unixtime_out_of_ALIPinfo = [not i for i in evaluation_point['unixtime'].apply(lambda x:is_unixtime_between_ALIP(x))]
-        eval_point = evaluation_point[is_unixtime_out_of_ALIPinfo]
+        eval_point = eval_point_ALAP
         logger.debug('evaluation point OUT OF ALIP period is selected')
     
     return eval_point
 
+def compile_ground_truth_index(ref_point, ans_point, ALIP_info, area_info):
+    '''
+    Compile ground truth of one trajectory number into index of evaluation points
+    Index holds everything derived from ground truth alone, so it can be shared by all trajectory files
+
+    Parameters
+    ----------
+    ref_point : DataFrame
+        reference point, None if it does not exist
+    ans_point : DataFrame
+        answer point
+    ALIP_info : DataFrame
+        ALIP period time information, None if it does not exist
+    area_info : DataFrame
+        columns = ['area', 'x_position_m', 'y_position_m', 'x_length', 'y_length'], None if it does not exist
+
+    Returns
+    -------
+    index : dictionary of ndarray
+        evaluation points sorted by time, keys are
+        'unixtime' : evaluation time
+        'ans_row' : row number in answer point
+        'is_ALIP' : point is between ALIP period or not
+        'in_area' : shape = (number of points, number of areas), point is inside each area or not
+        'ref_delta_t' : absolute time to nearest reference point, nan if reference does not exist
+        'has_ALIP' : 0-d array, ALIP info exists or not
+    '''
+    if ref_point is None:
+        evaluation_point = ans_point
+    else:
+        evaluation_point = drop_ans_duplicated_with_ref(ans_point, ref_point)
+
+    unixtime = evaluation_point['unixtime'].values.astype(float)
+    ans_row = ans_point.index.get_indexer(evaluation_point.index)
+
+    if ALIP_info is None:
+        is_ALIP = np.zeros(len(evaluation_point), dtype=bool)
+    else:
+        _, _, interval_id = partition_evaluation_data_ALIP(evaluation_point, ALIP_info, return_interval_id=True)
+        is_ALIP = interval_id.values >= 0
+
+    area_num = 0 if area_info is None else len(area_info)
+    in_area = np.zeros((len(evaluation_point), area_num), dtype=bool)
+    for area in range(area_num):
+        area_eval_point = indicator_utils.filter_area_point(evaluation_point, area_info, area+1)
+        in_area[:, area] = evaluation_point.index.isin(area_eval_point.index)
+
+    if ref_point is None:
+        ref_delta_t = np.full(len(evaluation_point), np.nan)
+    else:
+        _, ref_delta_t = indicator_utils.nearest_time_index(ref_point['unixtime'].values, unixtime)
+
+    order = np.argsort(unixtime, kind='mergesort')
+    logger.debug('ground truth index is compiled, evaluation point:{}, ALIP:{}'.format(len(order), is_ALIP.sum()))
+    return {'unixtime': unixtime[order], 'ans_row': ans_row[order], 'is_ALIP': is_ALIP[order],
+            'in_area': in_area[order], 'ref_delta_t': ref_delta_t[order], 'has_ALIP': np.array(ALIP_info is not None)}
+
+def ground_truth_index(file_paths, compile_function, cache_dname=None):
+    '''
+    Get ground truth index, using on-disk cache if cache_dname is set
+    Cache is keyed by contents hash of ground truth files, so index is shared by all 
+    trajectory folders and tracks which use same files
+
+    Parameters
+    ----------
+    file_paths : list of str
+        ground truth files which index is compiled from
+    compile_function : callable
+        returns result of compile_ground_truth_index, called when index is not cached
+    cache_dname : str
+        cache directory, index is compiled every time if None
+
+    Returns
+    -------
+    index : dictionary of ndarray
+        result of compile_ground_truth_index
+    '''
+    if cache_dname is None:
+        return compile_function()
+
+    index_cache_dname = os.path.join(cache_dname, 'ground_truth_index')
+    os.makedirs(index_cache_dname, exist_ok=True)
+    cache_key = file_hash(file_paths)
+    index_path = os.path.join(index_cache_dname, '{}_{}.npz'.format(GROUND_TRUTH_INDEX_VERSION, cache_key))
+
+    if not os.path.exists(index_path):
+        index = compile_function()
+        replace_file(index_path, lambda f: np.savez(f, **index))
+        logger.debug('Ground truth index is saved at {}'.format(index_path))
+        return index
+
+    logger.debug('Loading ground truth index: {}'.format(index_path))
+    with np.load(index_path) as index_file:
+        return {name: index_file[name] for name in index_file.files}
+
 def map_color(map_obstacle_color, map_trajectory_color, map_ref_color, map_BLE_color):
     '''
     Load map color
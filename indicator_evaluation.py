@@ -9,21 +9,54 @@ import statistics
 import pandas as pd
 import numpy as np
 import seaborn as sns
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from logging import getLogger
 from functools import wraps
-from tqdm import tqdm
+from scipy import signal
 from scipy.stats import kde
 import warnings
 
+import indicator_kernels
 import indicator_utils
 
 
-tqdm.pandas()
 logger = getLogger("__main__").getChild("indicator_evaluation")
 warnings.filterwarnings('ignore')
 
 class CalcIndicator(object):
+    def __init__(self, kde_fft=False, kde_refine=False, draw_figure=True):
+        # Evaluate kernel density by binning and FFT convolution instead of direct gaussian_kde
+        self.kde_fft = kde_fft
+        # Search density mode coarse to fine instead of evaluating full grid
+        self.kde_refine = kde_refine
+        # Create CA figures, CA and CP are calculated without matplotlib if False
+        self.draw_figure = draw_figure
+
+        # Correspond points of current file, keyed by identity of input points
+        self.correspond_cache = dict()
+        self.correspond_cache_hits = 0
+        self.correspond_cache_misses = 0
+
+    def clear_correspond_cache(self):
+        '''
+        Evict cached correspond points, call when evaluation moves to next file
+        '''
+        logger.debug('correspond cache clear: {}'.format(self.correspond_cache_info()))
+        self.correspond_cache.clear()
+
+    def correspond_cache_info(self):
+        '''
+        Returns
+        -------
+        cache_info : dictionary
+            keys = ['hits', 'misses', 'size']
+        '''
+        return {'hits': self.correspond_cache_hits,
+                'misses': self.correspond_cache_misses,
+                'size': len(self.correspond_cache)}
+
     def extract_correspond_point(self, tra_point, eval_point, sec_limit=1.0):
 
         '''
@@ -43,40 +76,32 @@ class CalcIndicator(object):
         correspond_df : DataFrame
             columns = ['unixtime', 'tra_x', 'tra_y', 'eval_x', 'eval_y', 'correspond_time']
         '''
-        # Calculate euclidean distance
-        unixtime_list = []
-        tra_x_list = []
-        tra_y_list = []
-        eval_x_list = []
-        eval_y_list = []
-        correspond_time_list = []
-
-        def Calc_correspond(row):
-            try:
-                diff_abs = np.abs(np.full(len(tra_point), row['unixtime']) - tra_point['unixtime'])
-                min_index = diff_abs.argmin()
-
-                if diff_abs[min_index] <= sec_limit:
-                    unixtime_list.append(row['unixtime'])
-                    tra_x_list.append(tra_point['x_position_m'][min_index])
-                    tra_y_list.append(tra_point['y_position_m'][min_index])
-                    eval_x_list.append(row['x_position_m'])
-                    eval_y_list.append(row['y_position_m'])
-                    correspond_time_list.append(diff_abs[min_index])
-                else: #no match
-                    logger.debug('warning : no match traj_point and eval_point at unixtime {}'.format(row['unixtime']))
-            
-            except ValueError:
-                logger.debug('warning : value error occurred at unixtime {}'.format(row['unixtime']))
-
-        eval_point.apply(Calc_correspond, axis=1).values
-        correspond_df = pd.DataFrame({'unixtime' : unixtime_list,
-                              'tra_x' : tra_x_list,
-                              'tra_y' : tra_y_list,
-                              'eval_x' : eval_x_list,
-                              'eval_y' : eval_y_list,
-                              'correspond_time' : correspond_time_list})
-        return correspond_df
+        # Cached entry keeps input points, so their ids are not reused while cache holds them
+        cache_key = (id(tra_point), len(tra_point), id(eval_point), len(eval_point), sec_limit)
+        if cache_key in self.correspond_cache:
+            self.correspond_cache_hits += 1
+            return self.correspond_cache[cache_key][2].copy()
+        self.correspond_cache_misses += 1
+
+        # Match nearest trajectory time by binary search
+        tra_index, correspond_time = indicator_utils.nearest_time_index(tra_point['unixtime'].values,
+                                                                        eval_point['unixtime'].values)
+        is_matched = (tra_index >= 0) & (correspond_time <= sec_limit)
+
+        for unixtime in eval_point['unixtime'].values[~is_matched]:
+            logger.debug('warning : no match traj_point and eval_point at unixtime {}'.format(unixtime))
+
+        tra_index = tra_index[is_matched]
+        correspond_df = pd.DataFrame({'unixtime' : eval_point['unixtime'].values[is_matched],
+                              'tra_x' : tra_point['x_position_m'].values[tra_index],
+                              'tra_y' : tra_point['y_position_m'].values[tra_index],
+                              'eval_x' : eval_point['x_position_m'].values[is_matched],
+                              'eval_y' : eval_point['y_position_m'].values[is_matched],
+                              'correspond_time' : correspond_time[is_matched]})
+
+        # Callers add indicator columns, so hand out copies of cached frame
+        self.correspond_cache[cache_key] = (tra_point, eval_point, correspond_df)
+        return correspond_df.copy()
 
     def CE_calculation(self, tra_point, eval_point_ALAP):
         '''
@@ -98,16 +123,11 @@ class CalcIndicator(object):
         logger.debug('Calculate Circular Error (CE) START')
 
         correspond_df = self.extract_correspond_point(tra_point, eval_point_ALAP)
-
-        def Calc_CE(row):
-            error_m_value = math.hypot(row['tra_x'] - row['eval_x'], row['tra_y'] - row['eval_y'])
-            return error_m_value
-        
-        correspond_df['CE'] = correspond_df.apply(Calc_CE, axis=1)
+        correspond_df['CE'] = indicator_kernels.circular_error(*indicator_kernels.correspond_xy(correspond_df))
         logger.debug('Calculate Circular Error(CE) END')
         return correspond_df
 
-    def EAG_calculation(self, tra_point, ref_point, eval_point_ALIP):
+    def EAG_calculation(self, tra_point, ref_point, eval_point_ALIP, since_previous_ref=False, ref_time_index=None):
         '''
         Calculate Error Accumulation Gradient (EAG)
 
@@ -119,35 +139,38 @@ class CalcIndicator(object):
             groudtruth point data for evaluation 
         eval_point_ALIP : DataFrame
             evaluation poins in ALIP, columns = ['unixtime', 'x_position_m', 'y_position_m']
+        since_previous_ref : boolean
+            add signed time since previous reference point as 'delta_t_previous' column
+        ref_time_index : tuple of ndarray
+            sorted evaluation unixtime and absolute time to nearest reference point of ground truth index,
+            searched from ref_point if None
 
         Returns
         -------
         EAG_df : DataFrame
-            columns = ['unixtime', 'tra_x', 'tra_y', 'eval_x', 'eval_y', 'correspond_time', 'EAG', 'delta_t']
+            columns = ['unixtime', 'tra_x', 'tra_y', 'eval_x', 'eval_y', 'correspond_time', 'delta_t', 'EAG']
 
         '''
 
         logger.debug('Calculate Error Accumulation Gradient (EAG) START')   
 
-        # Calculate unixtime absolute error between reference point and evaluation point in ALIP
-        def unixtime_delta_min(x):
-            delta_t_list = abs(np.full(len(ref_point), x) - ref_point['unixtime'])
-            delta_t_min = min(delta_t_list)
-            return delta_t_min
-
         correspond_df = self.extract_correspond_point(tra_point, eval_point_ALIP)
-        eval_point_delta_t = correspond_df['unixtime'].apply(lambda x : unixtime_delta_min(x))
-
         correspond_df.reset_index(drop=True, inplace=True)
-        # Escape pandas SettingwithCopyWarning
-        correspond_df = correspond_df.copy() 
-        correspond_df['delta_t'] = eval_point_delta_t.values
-
-        def Calc_EAG(row):
-            error_m_value = math.hypot(row['tra_x'] - row['eval_x'], row['tra_y'] - row['eval_y']) / row['delta_t']
-            return error_m_value
 
-        correspond_df['EAG'] = correspond_df.apply(Calc_EAG, axis=1)
+        # Calculate unixtime absolute error between nearest reference point and evaluation point in ALIP
+        if ref_time_index is None:
+            _, eval_point_delta_t = indicator_utils.nearest_time_index(ref_point['unixtime'].values,
+                                                                       correspond_df['unixtime'].values)
+        else:
+            eval_unixtime, ref_delta_t = ref_time_index
+            eval_point_delta_t = ref_delta_t[np.searchsorted(eval_unixtime, correspond_df['unixtime'].values)]
+        correspond_df['delta_t'] = eval_point_delta_t
+        if since_previous_ref:
+            correspond_df['delta_t_previous'] = indicator_utils.previous_time_delta(ref_point['unixtime'].values,
+                                                                                    correspond_df['unixtime'].values)
+
+        correspond_df['EAG'] = indicator_kernels.error_accumulation_gradient(*indicator_kernels.correspond_xy(correspond_df),
+                                                                             correspond_df['delta_t'].values)
         logger.debug('Calculate Error Accumulation Gradient (EAG) END')
         return correspond_df
 
@@ -173,18 +196,18 @@ class CalcIndicator(object):
         correspond_df = self.extract_correspond_point(tra_point, eval_point)
 
         error_xy_series = self.calc_error_dist(tra_point, eval_point)
-        xi, yi, zi = self.calc_kernel_density(error_xy_series['x_error'].to_list(), 
-                                                error_xy_series['y_error'].to_list(), 
-                                                bw_method=band_width)
-        x_mod, y_mod = self.calc_density_mode(xi, yi, zi)
-
-        def Calc_CP(row):
-            error_x = row['tra_x'] - row['eval_x']
-            error_y = row['tra_y'] - row['eval_y']
-            error_dist_value = math.hypot(error_x - x_mod, error_y - y_mod)
-            return error_dist_value
-
-        correspond_df['CP'] = correspond_df.apply(Calc_CP, axis=1)
+        if self.kde_refine:
+            x_mod, y_mod = self.calc_density_mode_refine(error_xy_series['x_error'].to_list(),
+                                                         error_xy_series['y_error'].to_list(),
+                                                         bw_method=band_width)
+        else:
+            xi, yi, zi = self.calc_kernel_density(error_xy_series['x_error'].to_list(), 
+                                                    error_xy_series['y_error'].to_list(), 
+                                                    bw_method=band_width)
+            x_mod, y_mod = self.calc_density_mode(xi, yi, zi)
+
+        correspond_df['CP'] = indicator_kernels.circular_precision(*indicator_kernels.correspond_xy(correspond_df),
+                                                                   x_mod, y_mod)
         
         logger.debug('Calculate Presicion Error(CP) END')
         return correspond_df
@@ -192,12 +215,9 @@ class CalcIndicator(object):
     def calc_error_dist(self, tra_point, eval_point):
 
         correspond_df = self.extract_correspond_point(tra_point, eval_point)
-        def error_m_xy(row):    
-            x_error, y_error = row['tra_x'] - row['eval_x'], row['tra_y'] - row['eval_y']
-            return  pd.Series([x_error, y_error])
+        x_error, y_error = indicator_kernels.error_vector(*indicator_kernels.correspond_xy(correspond_df))
 
-        result = pd.DataFrame({'x_error':[], 'y_error':[]})
-        result[['x_error', 'y_error']] = correspond_df.apply(error_m_xy, axis=1)
+        result = pd.DataFrame({'x_error': x_error, 'y_error': y_error})
         return result
     
     def CA_2Dhistgram_calculation(self, tra_point, eval_point):
@@ -215,41 +235,19 @@ class CalcIndicator(object):
         Returns
         ------- 
         CA: float
-        fig: matplotlib Figure object 
+        fig: matplotlib Figure object, None if draw_figure is False
         '''
         
         error_xy_series = self.calc_error_dist(tra_point, eval_point)
-        
-        def calc_2D_histgram_mod(x_error_list, y_error_list):
-            
-            fig = plt.figure()
-            
-            plt.rcParams['font.size'] = 12
-            xmax = max(np.abs(x_error_list))
-            ymax = max(np.abs(y_error_list))
-
-            xbin = math.floor(xmax * 2/0.5)
-            ybin = math.floor(ymax * 2/0.5)
-
-            counts, xedges, yedges, _ = plt.hist2d(x_error_list,y_error_list, bins=(xbin, ybin))
-            x_delta = xedges[1] - xedges[0]
-            y_delta = yedges[1] - yedges[0]
-            
-            idx = np.unravel_index(np.argmax(counts), counts.shape)
-            
-            x_mod = xedges[idx[0]] + x_delta/2
-            y_mod = yedges[idx[1]] + y_delta/2
-            
-            plt.plot(x_mod, y_mod, marker='^', color='forestgreen', 
-                    markerfacecolor='white', markeredgewidth=2, markersize=12)
-            plt.xlabel('X error')
-            plt.ylabel('Y error')
-            plt.close()
-            
-            return x_mod, y_mod, fig
-
-        x_mod, y_mod, fig = calc_2D_histgram_mod(error_xy_series['x_error'].to_list(), 
-                                                error_xy_series['y_error'].to_list())
+        x_error_list = error_xy_series['x_error'].to_list()
+        y_error_list = error_xy_series['y_error'].to_list()
+
+        x_mod, y_mod, xedges, yedges = self.calc_2D_histgram_mode(x_error_list, y_error_list)
+
+        if self.draw_figure:
+            fig = self.figure_2D_histgram(x_error_list, y_error_list, xedges, yedges, x_mod, y_mod)
+        else:
+            fig = None
 
         logger.debug('x mod: {}, y mod: {}'.format(x_mod, y_mod))
 
@@ -259,6 +257,52 @@ class CalcIndicator(object):
 
         return CA, fig
 
+    def calc_2D_histgram_mode(self, x_error_list, y_error_list):
+        '''
+        Calculate mode of XY error by 2D histgram of 0.5 m bins
+
+        Parameters
+        ----------
+        x_error_list, y_error_list : list of float
+
+        Returns
+        -------
+        x_mod, y_mod : float
+            center of most frequent bin
+        xedges, yedges : ndarray of float
+            bin edges
+        '''
+        xmax = max(np.abs(x_error_list))
+        ymax = max(np.abs(y_error_list))
+
+        xbin = math.floor(xmax * 2/0.5)
+        ybin = math.floor(ymax * 2/0.5)
+
+        counts, xedges, yedges = np.histogram2d(x_error_list, y_error_list, bins=(xbin, ybin))
+        x_delta = xedges[1] - xedges[0]
+        y_delta = yedges[1] - yedges[0]
+        
+        idx = np.unravel_index(np.argmax(counts), counts.shape)
+        
+        x_mod = xedges[idx[0]] + x_delta/2
+        y_mod = yedges[idx[1]] + y_delta/2
+
+        return x_mod, y_mod, xedges, yedges
+
+    def figure_2D_histgram(self, x_error_list, y_error_list, xedges, yedges, x_mod, y_mod):
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        
+        matplotlib.rcParams['font.size'] = 12
+        ax = fig.add_subplot(111)
+        ax.hist2d(x_error_list, y_error_list, bins=(xedges, yedges))
+        ax.plot(x_mod, y_mod, marker='^', color='forestgreen', 
+                markerfacecolor='white', markeredgewidth=2, markersize=12)
+        ax.set_xlabel('X error')
+        ax.set_ylabel('Y error')
+        
+        return fig
+
     def CA_KernelDensity_calculation(self, tra_point, eval_point, band_width=None):
         '''
         Calculate Circular Error Distribution Deviation by kernel density (CA)
@@ -277,16 +321,29 @@ class CalcIndicator(object):
         Returns
         ------- 
         CA : float 
-        fig: matplotlib Figure object 
+        fig: matplotlib Figure object, None if draw_figure is False
         '''
 
         error_xy_series = self.calc_error_dist(tra_point, eval_point)
         
-        xi, yi, zi = self.calc_kernel_density(error_xy_series['x_error'].to_list(), 
-                                                error_xy_series['y_error'].to_list(), 
-                                                bw_method=band_width)
-        x_mod, y_mod = self.calc_density_mode(xi, yi, zi)
-        fig = self.figure_density(xi, yi, zi, x_mod, y_mod)
+        if self.kde_refine and not self.draw_figure:
+            x_mod, y_mod = self.calc_density_mode_refine(error_xy_series['x_error'].to_list(),
+                                                         error_xy_series['y_error'].to_list(),
+                                                         bw_method=band_width)
+        elif self.kde_refine:
+            x_mod, y_mod, xi, yi, zi = self.calc_density_mode_refine(error_xy_series['x_error'].to_list(),
+                                                                     error_xy_series['y_error'].to_list(),
+                                                                     bw_method=band_width, return_grid=True)
+        else:
+            xi, yi, zi = self.calc_kernel_density(error_xy_series['x_error'].to_list(), 
+                                                    error_xy_series['y_error'].to_list(), 
+                                                    bw_method=band_width)
+            x_mod, y_mod = self.calc_density_mode(xi, yi, zi)
+
+        if self.draw_figure:
+            fig = self.figure_density(xi, yi, zi, x_mod, y_mod)
+        else:
+            fig = None
 
         logger.debug('x mod: {}, y mod: {}'.format(x_mod, y_mod))
         
@@ -297,6 +354,8 @@ class CalcIndicator(object):
         return CA, fig
 
     def calc_kernel_density(self, x, y, bw_method=None):
+        if self.kde_fft:
+            return self.calc_kernel_density_fft(x, y, bw_method=bw_method)
 
         nbins=300
         k = kde.gaussian_kde([x,y], bw_method=bw_method)
@@ -308,6 +367,64 @@ class CalcIndicator(object):
             return np.mean(x), np.mean(y)
         return xi, yi, zi
     
+    def calc_kernel_density_fft(self, x, y, bw_method=None):
+        '''
+        Calculate kernel density on the same grid as calc_kernel_density
+        Samples are linearly binned onto the grid and convolved with gaussian kernel via FFT,
+        kernel covariance follows gaussian_kde bandwidth rule
+
+        Parameters
+        ----------
+        x, y : list of float
+            XY error
+        bw_method : str, scalar or callable
+            bandwidth rule for gaussian_kde
+
+        Returns
+        -------
+        xi, yi : ndarray of float
+            grid coordinates, shape = (nbins, nbins)
+        zi : ndarray of float
+            density on grid, flattened
+        '''
+        nbins=300
+        k = kde.gaussian_kde([x,y], bw_method=bw_method)
+        xi, yi = np.mgrid[min(x)-2:max(x)+2:nbins*1j, min(y)-2:max(y)+2:nbins*1j]
+        try:
+            inv_cov = np.linalg.inv(k.covariance)
+        except np.linalg.LinAlgError:
+            logger.debug('Unable to calculate inverse matrix, return mean value')
+            return np.mean(x), np.mean(y)
+
+        x_grid, y_grid = xi[:, 0], yi[0]
+        dx, dy = x_grid[1] - x_grid[0], y_grid[1] - y_grid[0]
+
+        # Linear binning, each sample is shared by 4 surrounding grid points
+        gx = (np.asarray(x, dtype=float) - x_grid[0]) / dx
+        gy = (np.asarray(y, dtype=float) - y_grid[0]) / dy
+        ix = np.clip(np.floor(gx).astype(int), 0, nbins-2)
+        iy = np.clip(np.floor(gy).astype(int), 0, nbins-2)
+        fx, fy = gx - ix, gy - iy
+
+        binned = np.zeros(nbins*nbins)
+        for x_offset, x_weight in [(0, 1-fx), (1, fx)]:
+            for y_offset, y_weight in [(0, 1-fy), (1, fy)]:
+                binned += np.bincount((ix+x_offset)*nbins + iy+y_offset, weights=x_weight*y_weight,
+                                      minlength=nbins*nbins)
+        binned = binned.reshape(nbins, nbins) / len(gx)
+
+        # Gaussian kernel on grid offsets, truncated at 4 sigma
+        x_half = min(nbins-1, int(np.ceil(4 * np.sqrt(k.covariance[0, 0]) / dx)))
+        y_half = min(nbins-1, int(np.ceil(4 * np.sqrt(k.covariance[1, 1]) / dy)))
+        kx, ky = np.mgrid[-x_half:x_half+1, -y_half:y_half+1]
+        kx, ky = kx * dx, ky * dy
+        quad = inv_cov[0, 0]*kx**2 + 2*inv_cov[0, 1]*kx*ky + inv_cov[1, 1]*ky**2
+        kernel = np.exp(-0.5 * quad) / (2 * np.pi * np.sqrt(np.linalg.det(k.covariance)))
+
+        zi = signal.fftconvolve(binned, kernel, mode='same')
+        zi = np.maximum(zi, 0).flatten()
+        return xi, yi, zi
+
     def calc_density_mode(self, xi, yi, zi):
         row_idx = np.argmax(zi) // len(xi)
         col_idx = np.argmax(zi) % len(yi)
@@ -315,24 +432,92 @@ class CalcIndicator(object):
         y_mod = yi[0][col_idx].round(2)
         return x_mod, y_mod
 
+    def calc_density_mode_refine(self, x, y, bw_method=None, precision=0.01, return_grid=False):
+        '''
+        Search mode of kernel density from coarse grid to fine grid
+        Grid is laid in coordinates whitened by kernel covariance, where kernel is circle of unit standard deviation,
+        so correlated XY error whose kernel is thin ellipse is not missed between grid points.
+        Coarse grid step is kernel standard deviation, then grids around top cells
+        are refined until grid step is below half of precision in XY coordinates
+
+        Parameters
+        ----------
+        x, y : list of float
+            XY error
+        bw_method : str, scalar or callable
+            bandwidth rule for gaussian_kde
+        precision : float
+            rounding precision of mode [m]
+        return_grid : boolean
+            also return full density grid of calc_kernel_density, for figure
+
+        Returns
+        -------
+        x_mod, y_mod : float
+        xi, yi, zi : ndarray of float
+            only returned when return_grid is True
+        '''
+        max_nbins = 300
+        refine_nbins = 9
+        top_num = 4
+        margin = 3
+        decimals = int(round(-np.log10(precision)))
+
+        k = kde.gaussian_kde([x,y], bw_method=bw_method)
+
+        try:
+            # XY point = whiten @ whitened point
+            whiten = np.linalg.cholesky(k.covariance)
+            whitened_data = np.linalg.solve(whiten, k.dataset)
+            lower = whitened_data.min(axis=1) - margin
+            upper = whitened_data.max(axis=1) + margin
+            coarse_nbins = np.clip(np.ceil(upper - lower).astype(int) + 1, 2, max_nbins)
+
+            ui, vi = np.mgrid[lower[0]:upper[0]:coarse_nbins[0]*1j, lower[1]:upper[1]:coarse_nbins[1]*1j]
+            grid_point = np.vstack([ui.flatten(), vi.flatten()])
+            grid_density = k(whiten @ grid_point)
+            step = (upper - lower) / (coarse_nbins - 1)
+
+            # Zoom into windows around top cells until step is fine enough in XY coordinates
+            while np.any(np.abs(whiten) @ step > precision / 2):
+                top_point = grid_point[:, np.argsort(grid_density)[::-1][:top_num]]
+                offset = np.linspace(-1, 1, refine_nbins)
+                ou, ov = np.meshgrid(offset * step[0], offset * step[1], indexing='ij')
+                window_point = np.hstack([np.vstack([pu + ou.flatten(), pv + ov.flatten()])
+                                          for pu, pv in top_point.T])
+                grid_point = np.hstack([top_point, window_point])
+                grid_density = k(whiten @ grid_point)
+                step = step * 2 / (refine_nbins - 1)
+        except:
+            logger.debug('Unable to calculate inverse matrix, return mean value')
+            return np.mean(x), np.mean(y)
+
+        mode_point = whiten @ grid_point[:, np.argmax(grid_density)]
+        x_mod, y_mod = mode_point.round(decimals)
+
+        if return_grid:
+            xi, yi, zi = self.calc_kernel_density(x, y, bw_method=bw_method)
+            return x_mod, y_mod, xi, yi, zi
+        return x_mod, y_mod
+
     def figure_density(self, xi, yi, zi, x_mod, y_mod):
-        fig = plt.figure()
+        fig = Figure()
+        FigureCanvasAgg(fig)
         sns.set_style('whitegrid')
-        plt.rcParams['font.size'] = 12
+        matplotlib.rcParams['font.size'] = 12
 
-        plt.pcolormesh(xi, yi, zi.reshape(xi.shape), cmap='jet')
-        plt.plot(x_mod, y_mod, marker='^', color='forestgreen', 
+        ax = fig.add_subplot(111)
+        ax.pcolormesh(xi, yi, zi.reshape(xi.shape), cmap='jet')
+        ax.plot(x_mod, y_mod, marker='^', color='forestgreen', 
                 markerfacecolor='white', markeredgewidth=2, markersize=12)
-        plt.title('x: {:.2f} y: {:.2f}'.format(x_mod, y_mod))
-        plt.xlabel('X error')
-        plt.ylabel('Y error')
-
-        plt.close()
+        ax.set_title('x: {:.2f} y: {:.2f}'.format(x_mod, y_mod))
+        ax.set_xlabel('X error')
+        ax.set_ylabel('Y error')
         
         return fig
 
     def Area_weighted_CA_calculation(self, tra_point, eval_point, area_info, 
-                                    area_weights, use_2d_hist=False, band_width=None):
+                                    area_weights, use_2d_hist=False, band_width=None, area_eval_points=None):
         '''
         Calculate Area Weighted Circular Error Distribution Deviation 
         
@@ -347,24 +532,31 @@ class CalcIndicator(object):
         area_weights: list of float
         use_kde: boolean
         band_width: float
+        area_eval_points: list of DataFrame
+            eval_point inside each area, filtered here if None
 
         Returns
         -------
         area_weighted_CA: float
         CA_df: DataFrame, columns = ['area', 'CA']
-        fig_list: list of Figure
+        fig_list: list of Figure, items are None if draw_figure is False
         '''
 
         CA_list = []
         area_list = []
         fig_list = []
         for area_num in range(len(area_info)):
-            area_eval_point = indicator_utils.filter_area_point(eval_point, area_info, area_num+1)
+            if area_eval_points is None:
+                area_eval_point = indicator_utils.filter_area_point(eval_point, area_info, area_num+1)
+            else:
+                area_eval_point = area_eval_points[area_num]
             if len(area_eval_point) == 0:
                 CA = 0
-                CA_fig = plt.figure()
-                plt.close()
-                fig_list.append(CA_fig)
+                if self.draw_figure:
+                    CA_fig = Figure()
+                    FigureCanvasAgg(CA_fig)
+                else:
+                    CA_fig = None
             else:
                 if use_2d_hist:
                     CA, CA_fig = self.CA_2Dhistgram_calculation(tra_point, area_eval_point)
@@ -424,7 +616,7 @@ class CalcIndicator(object):
 
         return moving_velocity_check
 
-    def requirement_obstacle_check(self, tra_point, obstacle, map_size):
+    def requirement_obstacle_check(self, tra_point, obstacle, map_size, obstacle_mask=None):
         '''
         Calculate requirement for obstacle avoidance
 
@@ -432,10 +624,12 @@ class CalcIndicator(object):
         ---------- 
         tra_point : DataFrame
             columns = ['unixtime', 'x_position_m', 'y_position_m']
-        obstacle : ndarray
-            groudtruth obstacle bitmap data 
+        obstacle : ndarray of uint8
+            groudtruth obstacle bitmap data, value 1 is obstacle
         map_size : ndarray of float
             map size like [x_length, y_length]
+        obstacle_mask : ndarray of bool
+            result of indicator_utils.obstacle_interior_mask for obstacle, calculated if None
         
         Returns
         ------- 
@@ -445,220 +639,32 @@ class CalcIndicator(object):
 
         logger.debug('Calculate requirement for obstacle avoidance START')
 
+        if obstacle_mask is None:
+            obstacle_mask = indicator_utils.obstacle_interior_mask(obstacle)
+
         x_block_m = len(obstacle[0]) / map_size[0]
         y_block_m = len(obstacle) / map_size[1]
 
         # Convert bitmap coordinate to mapsize coordinate
-        tra_point = tra_point.copy()
-        tra_point['x_block_num'] = (tra_point['x_position_m'] * x_block_m).map(lambda x: int(x) -1 if int(x)!=0 else 0)
+        def block_num(position_block):
+            block = np.trunc(position_block).astype(int)
+            return np.where(block != 0, block - 1, 0)
 
-        tra_point['y_block_num'] = ((map_size[1] - tra_point['y_position_m']) * y_block_m).map(lambda x: int(x) -1 if int(x)!=0 else 0)
+        x_block_num = block_num(tra_point['x_position_m'].values * x_block_m)
+        y_block_num = block_num((map_size[1] - tra_point['y_position_m'].values) * y_block_m)
 
-        dif_tra_point = tra_point.diff()[1:].reset_index(drop=True) # x_block_num_t1 - x_block_num
-        dif_tra_point = dif_tra_point.append(pd.Series([0, 0, 0, 0, 0], index=dif_tra_point.columns, name=len(tra_point)-1)) 
-        
-        tra_point['x_block_num_dif'] = dif_tra_point['x_block_num'].astype(int)
-        tra_point['y_block_num_dif'] = dif_tra_point['y_block_num'].astype(int)
-        
-        # Auxiliary function to calculate E_obstacle
-        # check_pattern, is_inside_map, is_obstacle, is_obstacle_around, is_obstacle_exist, 
-        # ObstacleCordinate_count, CheckCordinate_count
-        def check_pattern(row):
-            '''
-            Fucntion to calculate obstacle error
-            Appoint pattern to trajection point
-
-            Parameters
-            ----------
-            row : pd.Series
-                trajection file row data
-
-            Return
-            ------
-            pattern : str
-                'A' or 'B' or 'C' or 'D'
-            '''
-
-            x_dif = row['x_block_num_dif']
-            y_dif = row['y_block_num_dif']
-            
-            if x_dif == 0:
-                if y_dif  > 0:
-                    return 'A'
-                else:
-                    return 'B'
-        
-            else:
-                if x_dif > 0:
-                    return 'C'
-                elif x_dif < 0:
-                    return 'D'
-
-        def is_inside_map(x, y):
-            '''
-            Fucntion to calculate obstacle error
-            Check wheather input cordinate is inside bitmap data or not
-
-            Parameters
-            ----------
-            x, y : int
-                Cordinates
-            
-            Returns
-            -------
-            boolean : bool
-                if cordinate is inside bitmap : True, else :  False
-            '''
-            if  0 <= x < obstacle.shape[1]  and 0 <= y < obstacle.shape[0]:
-                return True
-            else:
-                return False
-            
-        def is_obstacle(x, y):
-            '''
-            Fucntion to calculate obstacle error
-            Check wheather obstacle exsits on input cordinates in bitmap data or not
-            
-            Parameters
-            ----------
-            x, y : int
-                Cordinates
-            
-            Returns
-            -------
-            boolean : bool
-                if obstacle exists on input cordinates : True, else :  False
-            '''
-            if obstacle[y][x] == 1:
-                return True
-            else:
-                return False
-
-        def is_obstacle_around(x, y):
-            '''
-            Fucntion to calculate obstacle error
-            Check wheather all area around input cordinates are filled with obstacle or not
-            
-            Parameters
-            ----------
-            x, y : int
-                Cordinates
-            
-            Returns
-            -------
-            boolean : bool
-                if no empty point exist : True, else :  False
-            '''
-
-            for x_i in range(-3, 4):
-                for y_i in range(-3, 4):
-                    if is_inside_map(x + x_i, y + y_i):
-                        if not is_obstacle(x + x_i, y+y_i):
-                            return False          
-            return True
-
-        def is_obstacle_exist(x, y):
-            '''
-            Fucntion to calculate obstacle error
-            Check wheather obstacle exist on input cordinate including around area
-
-            Parameters
-            ----------
-            x, y : int
-                Cordinates
-            
-            Returns
-            -------
-            boolean : bool
-                if obstacle exist on input cordinates: True, else :  False
-            '''
-            if is_inside_map(x, y):
-                if is_obstacle(x, y):
-                    if is_obstacle_around(x, y):
-                        return True
-            return False
-        
-        def ObstacleCordinate_count(row):
-            '''
-            Fucntion to calculate obstacle error
-            Count total cordinates where obstacle exist in trajection data
-
-            Parameters
-            ----------
-            row : pd.Series
-                trajection file row data
-            
-            Returns
-            -------
-            obstacle_count : int
-                number of total cordinates where obstacle exist
-            '''
-
-            y_block_num = row['y_block_num']
-            y_block_num_t1 = y_block_num + row['y_block_num_dif']
-            
-            x_block_num = row['x_block_num']
-            x_block_num_t1 = x_block_num + row['x_block_num_dif']
-            
-            obstacle_count = 0
-            
-            if row['pattern'] == 'A':
-                for y in range(y_block_num, y_block_num_t1):
-                    if is_obstacle_exist(x_block_num, y):
-                        obstacle_count += 1
-
-            elif row['pattern'] == 'B':
-                for y in range(y_block_num, y_block_num_t1, -1):
-                    if is_obstacle_exist(x_block_num, y):
-                        obstacle_count += 1
-                    
-            elif row['pattern'] == 'C':
-                a = int((y_block_num - y_block_num_t1) / (x_block_num - x_block_num_t1))
-                b = y_block_num - (a * x_block_num)
-                for x in range(x_block_num, x_block_num_t1):
-                    y = int(a * x + b)
-                    if is_obstacle_exist(x, y):
-                        obstacle_count += 1
-                                        
-            elif row['pattern'] == 'D':
-                a = int((y_block_num - y_block_num_t1) / (x_block_num - x_block_num_t1))
-                b = y_block_num - (a * x_block_num)
-                for x in range(x_block_num, x_block_num_t1, -1):
-                    y = int(a * x + b)
-                    if is_obstacle_exist(x, y):
-                        obstacle_count += 1
-                
-            return obstacle_count
-
-        def CheckCordinate_count(row):
-            '''
-            Fucntion to calculate obstacle error
-            Count total codinates checked wheather obstacle exist or not
-
-            Parameters
-            ----------
-            row : pd.Series
-                trajection file row data
-            
-            Returns
-            -------
-            check_cordinate_count : int
-                number of total cordinates checked wheather obstacle exist or not
-            '''
-
-            pattern = row['pattern']
-            if pattern  == 'A' or pattern  == 'B':
-                return abs(row['y_block_num_dif'])
-            else:
-                return abs(row['x_block_num_dif'])
-                
-        tra_point['pattern'] = tra_point.apply(check_pattern, axis=1)
-        
-        obstacle_cordinate_count =  tra_point.progress_apply(ObstacleCordinate_count, axis=1)
-        check_cordinate_count = tra_point.apply(CheckCordinate_count, axis=1)
+        # Rasterize segment between each trajectory point and next point
+        segment, x_pixel, y_pixel, check_cordinate_count = indicator_utils.rasterize_segments(x_block_num, y_block_num)
+
+        is_inside_map = (0 <= x_pixel) & (x_pixel < obstacle_mask.shape[1]) & \
+                        (0 <= y_pixel) & (y_pixel < obstacle_mask.shape[0])
+        is_obstacle_exist = np.zeros(len(segment), dtype=bool)
+        is_obstacle_exist[is_inside_map] = obstacle_mask[y_pixel[is_inside_map], x_pixel[is_inside_map]]
+
+        obstacle_cordinate_count = np.bincount(segment[is_obstacle_exist], minlength=len(check_cordinate_count))
 
-        obstacle_check = pd.DataFrame({'check_cordinate_count': list(check_cordinate_count),
-                                      'obstacle_cordinate_count': list(obstacle_cordinate_count)})
+        obstacle_check = pd.DataFrame({'check_cordinate_count': check_cordinate_count,
+                                      'obstacle_cordinate_count': obstacle_cordinate_count})
                 
         logger.debug('Calculate requirement for obstacle avoidance END')
 
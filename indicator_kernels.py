@@ -0,0 +1,80 @@
+# coding: utf-8
+import numpy as np
+
+
+def correspond_xy(correspond_df):
+    '''
+    Get matched position arrays from correspond points
+
+    Parameters
+    ----------
+    correspond_df : DataFrame
+        columns = ['unixtime', 'tra_x', 'tra_y', 'eval_x', 'eval_y', 'correspond_time']
+
+    Returns
+    -------
+    tra_x, tra_y, eval_x, eval_y : ndarray of float
+    '''
+    return tuple(correspond_df[column].values.astype(float) for column in ['tra_x', 'tra_y', 'eval_x', 'eval_y'])
+
+def error_vector(tra_x, tra_y, eval_x, eval_y):
+    '''
+    Calculate XY error between matched trajectory points and evaluation points
+
+    Parameters
+    ----------
+    tra_x, tra_y : ndarray of float
+        matched trajectory position
+    eval_x, eval_y : ndarray of float
+        evaluation position
+
+    Returns
+    -------
+    x_error, y_error : ndarray of float
+    '''
+    x_error = np.asarray(tra_x, dtype=float) - np.asarray(eval_x, dtype=float)
+    y_error = np.asarray(tra_y, dtype=float) - np.asarray(eval_y, dtype=float)
+    return x_error, y_error
+
+def circular_error(tra_x, tra_y, eval_x, eval_y):
+    '''
+    Calculate Circular Error (CE) of matched points
+
+    Returns
+    -------
+    CE : ndarray of float
+    '''
+    x_error, y_error = error_vector(tra_x, tra_y, eval_x, eval_y)
+    return np.hypot(x_error, y_error)
+
+def circular_precision(tra_x, tra_y, eval_x, eval_y, x_mod, y_mod):
+    '''
+    Calculate Circular Precision (CP) of matched points
+
+    Parameters
+    ----------
+    x_mod, y_mod : float
+        mode of XY error distribution
+
+    Returns
+    -------
+    CP : ndarray of float
+        distance between XY error and mode of error distribution
+    '''
+    x_error, y_error = error_vector(tra_x, tra_y, eval_x, eval_y)
+    return np.hypot(x_error - x_mod, y_error - y_mod)
+
+def error_accumulation_gradient(tra_x, tra_y, eval_x, eval_y, delta_t):
+    '''
+    Calculate Error Accumulation Gradient (EAG) of matched points
+
+    Parameters
+    ----------
+    delta_t : ndarray of float
+        time between evaluation point and reference point
+
+    Returns
+    -------
+    EAG : ndarray of float
+    '''
+    return circular_error(tra_x, tra_y, eval_x, eval_y) / np.asarray(delta_t, dtype=float)
@@ -1,20 +1,43 @@
 # coding: utf-8
 import os 
+import multiprocessing
 
-import cv2
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+import matplotlib.image
 import seaborn as sns
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from scipy import ndimage
 from logging import getLogger
 
+from quantile_sketch import QuantileSketch
+
 logger = getLogger("__main__").getChild("indicator utility")
 
 class IndicatorHolder(object):
-    def __init__(self): 
+    '''
+    Hold indicators of each file and total indicators of all files
+
+    Parameters
+    ----------
+    exact_total : boolean
+        keep all values of total indicators regardless of exact_limit
+    sketch_size : int
+        accuracy parameter k of QuantileSketch
+    exact_limit : int
+        number of values of total indicator kept exactly, 
+        values are moved to QuantileSketch when it is exceeded
+    '''
+    def __init__(self, exact_total=False, sketch_size=200, exact_limit=1000000): 
+        self.exact_total = exact_total
+        self.sketch_size = sketch_size
+        self.exact_limit = exact_limit
         self.indicator_values = defaultdict(list)
-        self.indicator_total = defaultdict(pd.Series)
+        # list of Series while values are within exact_limit, otherwise QuantileSketch
+        self.indicator_total = dict()
         self.which_area = pd.DataFrame()
         self.file_indicator = None
 
@@ -22,8 +45,90 @@ class IndicatorHolder(object):
         self.indicator_values[indicator_name].append(indicator)
         
     def add_total_indicator(self, indicator_name, indicator_series):
-        self.indicator_total[indicator_name] = pd.concat([self.indicator_total[indicator_name],
-                                                          indicator_series], axis=0)
+        total = self.indicator_total.setdefault(indicator_name, [])
+        if isinstance(total, QuantileSketch):
+            total.update(indicator_series)
+            return
+
+        # Series are concatenated once when they are used
+        total.append(indicator_series)
+        total_num = sum(len(series) for series in total)
+        if not self.exact_total and total_num > self.exact_limit:
+            logger.debug('{} values of {} exceed exact limit, quantile sketch is used'.format(total_num, indicator_name))
+            sketch = QuantileSketch(k=self.sketch_size)
+            sketch.update(pd.concat(total, axis=0))
+            self.indicator_total[indicator_name] = sketch
+
+    def file_state(self, file_indicator, total_indicator):
+        '''
+        Convert indicators of one file to state which can be added by add_file_state
+
+        Parameters
+        ----------
+        file_indicator : list of tuple
+            (indicator name, value)
+        total_indicator : list of tuple
+            (indicator name, Series)
+
+        Returns
+        -------
+        file_state : dictionary
+            keys = ['file_indicator', 'total_indicator'], file indicator can be saved as json,
+            total indicator is ndarray of values
+        '''
+        total_state = [[indicator_name, np.asarray(indicator_series, dtype=float)] 
+                       for indicator_name, indicator_series in total_indicator]
+        file_indicator = [[indicator_name, value.item() if isinstance(value, np.generic) else value] 
+                          for indicator_name, value in file_indicator]
+        return {'file_indicator': file_indicator, 'total_indicator': total_state}
+
+    def add_file_state(self, file_state):
+        '''
+        Add indicators of one file converted by file_state
+
+        Parameters
+        ----------
+        file_state : dictionary
+        '''
+        for indicator_name, indicator in file_state['file_indicator']:
+            self.add_indicator_percentile(indicator_name, indicator)
+
+        for indicator_name, total_state in file_state['total_indicator']:
+            self.add_total_indicator(indicator_name, pd.Series(total_state, dtype=float))
+
+    def total_indicator_percentile(self, indicator_name, percentile):
+        '''
+        Percentile of total indicator values of all files
+
+        Parameters
+        ----------
+        indicator_name : str
+        percentile : float
+
+        Returns
+        -------
+        value : float
+        '''
+        total = self.indicator_total[indicator_name]
+        if isinstance(total, QuantileSketch):
+            return total.percentile(percentile)
+        return np.percentile(self.total_indicator_values(indicator_name)[0], percentile)
+
+    def total_indicator_values(self, indicator_name):
+        '''
+        Total indicator values of all files for figures
+
+        Returns
+        -------
+        values : Series or ndarray of float
+            all values if they are kept exactly, otherwise values kept in sketch
+        weights : ndarray of float
+            number of values each value stands for, None if values are kept exactly
+        '''
+        total = self.indicator_total[indicator_name]
+        if isinstance(total, QuantileSketch):
+            return total.weighted_items()
+        return pd.concat(total, axis=0), None
 
     def add_total_area_info(self, which_area_info):
         self.which_area = pd.concat([self.which_area, which_area_info], axis=0)
@@ -34,8 +139,8 @@ class IndicatorHolder(object):
 
     def summarize_total_indicator(self):
         indicator_summary = pd.DataFrame(self.file_indicator.mean()).T
-        for key, indicator in self.indicator_total.items():
-            indicator_summary[key] = np.median(indicator)
+        for key in self.indicator_total.keys():
+            indicator_summary[key] = self.total_indicator_percentile(key, 50)
         return indicator_summary
 
     def calc_total_indicator_percentile_each_area(self):
@@ -46,6 +151,149 @@ class IndicatorHolder(object):
         return area_indicator50
 
 
+def nearest_time_index(base_unixtime, target_unixtime):
+    '''
+    Find nearest base time for each target time by binary search on sorted base times
+    When several base times are equally near, the first one in base order is selected
+
+    Parameters
+    ----------
+    base_unixtime : ndarray of float
+        unixtime which is searched, need not be sorted
+    target_unixtime : ndarray of float
+        unixtime to search nearest base time for
+
+    Returns
+    -------
+    nearest_index : ndarray of int
+        position of nearest base time, -1 if there is no candidate
+    time_delta : ndarray of float
+        absolute time difference to nearest base time, nan if there is no candidate
+    '''
+    base_unixtime = np.asarray(base_unixtime, dtype=float)
+    target_unixtime = np.asarray(target_unixtime, dtype=float)
+
+    nearest_index = np.full(len(target_unixtime), -1, dtype=int)
+    time_delta = np.full(len(target_unixtime), np.nan)
+
+    # Stable sort keeps base order between equal times
+    base_valid = np.flatnonzero(~np.isnan(base_unixtime))
+    target_valid = np.flatnonzero(~np.isnan(target_unixtime))
+    if len(base_valid) == 0 or len(target_valid) == 0:
+        return nearest_index, time_delta
+
+    sort_order = base_valid[np.argsort(base_unixtime[base_valid], kind='mergesort')]
+    sorted_time = base_unixtime[sort_order]
+    base_num = len(sorted_time)
+    target = target_unixtime[target_valid]
+
+    # Neighbours on both sides of target time, first position among equal times
+    right = np.searchsorted(sorted_time, target, side='left')
+    left = right - 1
+    right_clip = np.minimum(right, base_num - 1)
+    left_clip = np.maximum(left, 0)
+    left_first = np.searchsorted(sorted_time, sorted_time[left_clip], side='left')
+
+    right_delta = np.where(right < base_num, np.abs(target - sorted_time[right_clip]), np.inf)
+    left_delta = np.where(left >= 0, np.abs(target - sorted_time[left_clip]), np.inf)
+    right_index = sort_order[right_clip]
+    left_index = sort_order[left_first]
+
+    use_left = (left_delta < right_delta) | ((left_delta == right_delta) & (left_index < right_index))
+    nearest_index[target_valid] = np.where(use_left, left_index, right_index)
+    time_delta[target_valid] = np.where(use_left, left_delta, right_delta)
+
+    return nearest_index, time_delta
+
+def previous_time_delta(base_unixtime, target_unixtime):
+    '''
+    Calculate signed time from latest base time at or before each target time by binary search
+    Target time before first base time gets negative time to first base time
+
+    Parameters
+    ----------
+    base_unixtime : ndarray of float
+        unixtime which is searched, need not be sorted
+    target_unixtime : ndarray of float
+
+    Returns
+    -------
+    time_delta : ndarray of float
+        target time - previous base time, nan if there is no base time
+    '''
+    base_unixtime = np.asarray(base_unixtime, dtype=float)
+    target_unixtime = np.asarray(target_unixtime, dtype=float)
+
+    sorted_time = np.sort(base_unixtime[~np.isnan(base_unixtime)])
+    if len(sorted_time) == 0:
+        return np.full(len(target_unixtime), np.nan)
+
+    previous_pos = np.searchsorted(sorted_time, target_unixtime, side='right') - 1
+    time_delta = target_unixtime - sorted_time[np.maximum(previous_pos, 0)]
+
+    return time_delta
+
+def obstacle_interior_mask(obstacle, around=3):
+    '''
+    Get obstacle pixels whose surrounding pixels inside map are all obstacle
+
+    Parameters
+    ----------
+    obstacle : ndarray
+        bitmap data, value 1 is obstacle
+    around : int
+        half width of surrounding area, (2*around+1) x (2*around+1) pixels are checked
+
+    Returns
+    -------
+    obstacle_mask : ndarray of bool
+        True where obstacle exists including around area
+    '''
+    # Pixels out of map are regarded as obstacle
+    structure = np.ones((2*around+1, 2*around+1), dtype=bool)
+    obstacle_mask = ndimage.binary_erosion(np.asarray(obstacle) == 1, structure=structure, border_value=1)
+    logger.debug('obstacle interior mask, obstacle pixels:{}'.format(np.count_nonzero(obstacle_mask)))
+    return obstacle_mask
+
+def rasterize_segments(x_block_num, y_block_num):
+    '''
+    Rasterize segments between consecutive points by DDA in one pass
+    Each segment is sampled once per pixel along its major axis,
+    start pixel is included and end pixel is excluded
+
+    Parameters
+    ----------
+    x_block_num, y_block_num : ndarray of int
+        pixel coordinates of points
+
+    Returns
+    -------
+    segment : ndarray of int
+        index of start point of segment which each pixel belongs to
+    x_pixel, y_pixel : ndarray of int
+        pixel coordinates on segments
+    step_count : ndarray of int
+        number of pixels of each segment, last point has 0
+    '''
+    x_block_num = np.asarray(x_block_num, dtype=int)
+    y_block_num = np.asarray(y_block_num, dtype=int)
+    point_num = len(x_block_num)
+
+    x_dif = np.zeros(point_num, dtype=int)
+    y_dif = np.zeros(point_num, dtype=int)
+    x_dif[:-1] = np.diff(x_block_num)
+    y_dif[:-1] = np.diff(y_block_num)
+    step_count = np.maximum(np.abs(x_dif), np.abs(y_dif))
+
+    segment = np.repeat(np.arange(point_num), step_count)
+    step = np.arange(len(segment)) - np.repeat(np.cumsum(step_count) - step_count, step_count)
+
+    step_ratio = step / step_count[segment]
+    x_pixel = x_block_num[segment] + np.floor(step_ratio * x_dif[segment] + 0.5).astype(int)
+    y_pixel = y_block_num[segment] + np.floor(step_ratio * y_dif[segment] + 0.5).astype(int)
+
+    return segment, x_pixel, y_pixel, step_count
+
 def save_indicator(data, save_dir, save_filename):
     '''
     save CE, EAG as csv
@@ -88,7 +336,77 @@ def area_of_ans(ans_point, area_info):
     which_area_series = ans_point.apply(get_area, axis=1)
     return which_area_series 
     
-def draw_cumulative_sum(data, indicator_name):
+def quantile_sample(data, max_points=2000, weights=None):
+    '''
+    Sort data and calculate eCDF, sampled at evenly spaced ranks if data is large
+    eCDF step between samples is far below one pixel of figure, so curve looks the same
+
+    Parameters
+    ----------
+    data : list of float
+    max_points : int
+    weights : ndarray of float
+        number of values each data stands for, each data is one value if None
+
+    Returns
+    -------
+    sorted_data : ndarray of float
+    eCDF : ndarray of float
+        percent of data at or below each sorted value
+    '''
+    data = np.asarray(data, dtype=float)
+    data_num = len(data)
+    if weights is None:
+        sorted_data = np.sort(data)
+        eCDF = np.arange(1, data_num + 1) * (100 / data_num)
+    else:
+        order = np.argsort(data, kind='mergesort')
+        sorted_data = data[order]
+        weights = np.asarray(weights, dtype=float)[order]
+        eCDF = np.cumsum(weights) * (100 / weights.sum())
+
+    if data_num > max_points:
+        sample_index = np.unique(np.linspace(0, data_num - 1, max_points).round().astype(int))
+        sorted_data, eCDF = sorted_data[sample_index], eCDF[sample_index]
+
+    return sorted_data, eCDF
+
+def decimate_line(x, y, pixel_size):
+    '''
+    Drop line points inside runs of consecutive points in same pixel
+    First and last points of each run are kept, so line differs less than one pixel
+
+    Parameters
+    ----------
+    x, y : ndarray of float
+    pixel_size : float
+        size of one pixel of figure in data unit
+
+    Returns
+    -------
+    x, y : ndarray of float
+        decimated points
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) <= 2:
+        return x, y
+
+    with np.errstate(invalid='ignore'):
+        x_pixel = np.floor(x / pixel_size)
+        y_pixel = np.floor(y / pixel_size)
+
+    # nan never equals, so nan points and their neighbours are kept and line breaks stay
+    same_as_previous = np.zeros(len(x), dtype=bool)
+    same_as_previous[1:] = (x_pixel[1:] == x_pixel[:-1]) & (y_pixel[1:] == y_pixel[:-1])
+    same_as_next = np.zeros(len(x), dtype=bool)
+    same_as_next[:-1] = same_as_previous[1:]
+    keep = ~(same_as_previous & same_as_next)
+
+    logger.debug('line is decimated from {} to {} points'.format(len(x), np.count_nonzero(keep)))
+    return x[keep], y[keep]
+
+def draw_cumulative_sum(data, indicator_name, weights=None):
     '''
     draw cumulative sum of EAG and CE
     
@@ -96,30 +414,27 @@ def draw_cumulative_sum(data, indicator_name):
     ----------
     data : list of float
     indicator_name : str
+    weights : ndarray of float
+        number of values each data stands for, e.g. values of QuantileSketch
     '''
 
-    eCDF_plus = 100 / len(data)
-    eCDF = [eCDF_plus]
-    for i in range(len(data)-1):
-        eCDF.append(eCDF[i] + eCDF_plus)
-
-    data.sort()
+    data, eCDF = quantile_sample(data, weights=weights)
 
-    fig = plt.figure()
+    fig = Figure()
+    FigureCanvasAgg(fig)
     sns.set_style('whitegrid')
-    plt.plot(data, eCDF)
-    plt.title(f'{indicator_name}')
-    if indicator_name is 'CE':
-        plt.xlabel(f'{indicator_name} [m]')
-    elif indicator_name is 'EAG':
-        plt.xlabel(f'{indicator_name} [m/s]')
-    plt.ylabel('eCDF')
-
-    plt.close()
+    ax = fig.add_subplot(111)
+    ax.plot(data, eCDF)
+    ax.set_title(f'{indicator_name}')
+    if indicator_name == 'CE':
+        ax.set_xlabel(f'{indicator_name} [m]')
+    elif indicator_name == 'EAG':
+        ax.set_xlabel(f'{indicator_name} [m/s]')
+    ax.set_ylabel('eCDF')
 
     return fig
 
-def draw_histgram(data, indicator_name, percentile=50, bins=None):
+def draw_histgram(data, indicator_name, percentile=50, bins=None, weights=None, percentile_value=None):
     '''
     draw histgram of EAG and CE
 
@@ -127,20 +442,26 @@ def draw_histgram(data, indicator_name, percentile=50, bins=None):
     ----------
     data : list of float
     bins : int
+    weights : ndarray of float
+        number of values each data stands for, e.g. values of QuantileSketch
+    percentile_value : float
+        percentile of data calculated beforehand, calculated from data if None
     '''
 
     logger.debug('draw histgram')
-    fig = plt.figure()
+    fig = Figure()
+    FigureCanvasAgg(fig)
     sns.set_style('whitegrid')
-    plt.rcParams['font.size'] = 12 
-    percentile_value = calc_percentile(data, percentile)
-    sns.distplot(data, kde=False, rug=False, bins=bins)
-    plt.axvline(percentile_value, color='k', linestyle='dashed', linewidth=1)
-    plt.title(f'{indicator_name}{percentile}: {percentile_value:.2f}')
-    plt.xlabel(f'{indicator_name}')
-    plt.ylabel('Frequency')
-
-    plt.close()
+    matplotlib.rcParams['font.size'] = 12 
+    if percentile_value is None:
+        percentile_value = calc_percentile(data, percentile)
+    ax = fig.add_subplot(111)
+    hist_kws = None if weights is None else {'weights': weights}
+    sns.distplot(data, kde=False, rug=False, bins=bins, ax=ax, hist_kws=hist_kws)
+    ax.axvline(percentile_value, color='k', linestyle='dashed', linewidth=1)
+    ax.set_title(f'{indicator_name}{percentile}: {percentile_value:.2f}')
+    ax.set_xlabel(f'{indicator_name}')
+    ax.set_ylabel('Frequency')
 
     return fig
     
@@ -154,6 +475,133 @@ def save_figure(figure, save_dir, save_filename):
     figure.savefig(fig_save_path)
     logger.debug('save figure at {}'.format(fig_save_path))
 
+# Arrays attached in figure rendering process, set by init_figure_worker
+figure_worker_arrays = dict()
+
+def set_figure_style():
+    '''
+    Set style which histgram drawing leaves for following figures
+    Figures rendered out of evaluation order need it to look the same
+    '''
+    sns.set_style('whitegrid')
+    matplotlib.rcParams['font.size'] = 12
+
+def init_figure_worker(array_paths=None):
+    '''
+    Set figure style and attach shared arrays for figure rendering process
+
+    Parameters
+    ----------
+    array_paths : dictionary
+        name -> .npy file path published by dataloader.publish_arrays
+    '''
+    set_figure_style()
+    figure_worker_arrays.clear()
+    for name, array_path in (array_paths or {}).items():
+        figure_worker_arrays[name] = np.load(array_path, mmap_mode='r')
+
+class SharedArrayName(object):
+    '''
+    Reference to array attached by init_figure_worker, sent instead of array itself
+    '''
+    def __init__(self, name):
+        self.name = name
+
+def render_figure(save_dir, save_filename, draw_function, args=(), kwargs=None):
+    '''
+    Draw figure and save it as png
+
+    Parameters
+    ----------
+    save_dir : str
+    save_filename : str
+    draw_function : callable or Figure
+        function which returns Figure, or Figure already drawn
+    args : tuple
+    kwargs : dictionary
+    '''
+    if isinstance(draw_function, Figure):
+        figure = draw_function
+    else:
+        args = [figure_worker_arrays[arg.name] if isinstance(arg, SharedArrayName) else arg for arg in args]
+        figure = draw_function(*args, **(kwargs or {}))
+    save_figure(figure, save_dir, save_filename)
+
+class FigureRenderer(object):
+    '''
+    Render figures queued from evaluation loop
+
+    Figures are rendered at submit if jobs is 0, otherwise in worker processes
+    until wait is called.
+
+    Parameters
+    ----------
+    jobs : int
+        number of figure rendering processes
+    shared_arrays : dictionary
+        name -> ndarray which workers attach once instead of receiving with each figure
+    array_paths : dictionary
+        name -> .npy file path of shared_arrays published by dataloader.publish_arrays
+    '''
+    def __init__(self, jobs=0, shared_arrays=None, array_paths=None):
+        self.jobs = jobs
+        self.results = []
+        self.pool = None
+        self.shared_arrays = dict()
+        if jobs > 0:
+            # Figures drawn in evaluation loop (CA) need same style as workers
+            set_figure_style()
+            self.shared_arrays = shared_arrays or {}
+            self.pool = multiprocessing.Pool(processes=jobs, initializer=init_figure_worker, initargs=(array_paths,))
+
+    def submit(self, save_dir, save_filename, draw_function, *args, **kwargs):
+        '''
+        Queue figure to render
+
+        Parameters
+        ----------
+        save_dir : str
+        save_filename : str
+        draw_function : callable or Figure
+            function which returns Figure, or Figure already drawn
+        args, kwargs :
+            arguments of draw_function
+        '''
+        if self.pool is None:
+            render_figure(save_dir, save_filename, draw_function, args, kwargs)
+            return
+
+        shared_names = {id(array): name for name, array in self.shared_arrays.items()}
+        args = tuple(SharedArrayName(shared_names[id(arg)]) if id(arg) in shared_names else arg for arg in args)
+        self.results.append((save_filename, self.pool.apply_async(render_figure, (save_dir, save_filename, draw_function, args, kwargs))))
+
+    def wait(self):
+        '''
+        Wait until all queued figures are rendered
+
+        Returns
+        -------
+        failed_num : int
+            number of figures which failed to render
+        '''
+        failed_num = 0
+        for save_filename, result in self.results:
+            try:
+                result.get()
+            except Exception:
+                logger.exception('{} rendering FAILED'.format(save_filename))
+                failed_num += 1
+        logger.debug('{} figures are rendered, {} failed'.format(len(self.results), failed_num))
+        self.results = []
+        return failed_num
+
+    def shutdown(self):
+        self.wait()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
 def save_total_indicator(data, indicator_name, save_dir, save_filename):
     save_path = os.path.join(save_dir, save_filename)
     save_df = pd.DataFrame({indicator_name : data})
@@ -228,6 +676,72 @@ def get_CA_area_weights(evaluation_point, area_info):
     
     return weights
 
+# Rasters of current map with axes limits they were made for, least recently used one is evicted over max_size
+map_raster_cache = {'map_image': None, 'rasters': OrderedDict(), 'max_size': 2}
+
+class CachedMapImage(matplotlib.image.AxesImage):
+    '''
+    AxesImage of map which reuses resampled raster across figures
+    One raster is kept for each colormap and axes position, 
+    it is made again and replaced when axes limits change
+
+    Parameters
+    ----------
+    ax : Axes
+    map_key : str
+        name of colormap, rasters of different colormaps are cached separately
+    kwargs :
+        arguments of AxesImage
+    '''
+    def __init__(self, ax, map_key=None, **kwargs):
+        super().__init__(ax, **kwargs)
+        self.map_key = map_key
+
+    def make_image(self, renderer, magnification=1.0, unsampled=False):
+        key = (self.map_key, tuple(self.axes.bbox.bounds), magnification, unsampled)
+        view = tuple(self.axes.viewLim.bounds)
+        rasters = map_raster_cache['rasters']
+        if key in rasters and rasters[key][0] == view:
+            rasters.move_to_end(key)
+            return rasters[key][1]
+
+        logger.debug('map raster is created for {} {}'.format(key, view))
+        rasters[key] = (view, super().make_image(renderer, magnification, unsampled))
+        rasters.move_to_end(key)
+        if len(rasters) > map_raster_cache['max_size']:
+            rasters.popitem(last=False)
+        return rasters[key][1]
+
+def draw_map_image(ax, map_image, map_size, cmap=None):
+    '''
+    Draw map on axes as background same as imshow, resampled raster is cached for following figures
+
+    Parameters
+    ----------
+    ax : Axes
+    map_image : ndarray
+        bitmap, same object is passed while map is same
+    map_size : float
+    cmap : Colormap
+
+    Returns
+    -------
+    image : CachedMapImage
+    '''
+    if map_raster_cache['map_image'] is not map_image:
+        map_raster_cache['map_image'] = map_image
+        map_raster_cache['rasters'] = OrderedDict()
+
+    extent = [0, map_size[0], 0, map_size[1]]
+    image = CachedMapImage(ax, map_key=None if cmap is None else cmap.name, cmap=cmap, extent=extent)
+    ax.set_aspect(matplotlib.rcParams['image.aspect'])
+    image.set_data(map_image)
+    image.set_clip_path(ax.patch)
+    image.autoscale_None()
+    image.set_extent(extent)
+    ax.add_image(image)
+    return image
+
 def draw_trajectory(tra_data, map_image, map_size, indicator_name, ref_point, BLE_info, map_color, map_makersize):
     '''
     draw trajectory on maps
@@ -235,21 +749,27 @@ def draw_trajectory(tra_data, map_image, map_size, indicator_name, ref_point, BL
     Parameters
     ----------
     tra_data : list of float
-    map_image : bitmap
+    map_image : ndarray of uint8
+        bitmap, value 1 is obstacle
     map_size : float
     '''
 
-    fig = plt.figure(dpi=600)
-    map_image2 = cv2.bitwise_not(map_image)
-    plt.imshow(map_image2, cmap=map_color[0], extent=[0, map_size[0], 0, map_size[1]])
-    plt.plot(tra_data['x_position_m'], tra_data['y_position_m'], color=map_color[1], lw=map_makersize[0], label='Trajectory')
-    plt.plot(ref_point['x_position_m'], ref_point['y_position_m'], color=map_color[2], linestyle='None', marker='+', markersize=map_makersize[1], label='Reference')
-    plt.plot(BLE_info['x_position_m'], BLE_info['y_position_m'], color=map_color[3], linestyle='None', marker='.', markersize=map_makersize[2], label='BLE')
-    plt.title(f'{indicator_name}')
-    plt.xlabel('x [m]')
-    plt.ylabel('y [m]')
-    plt.legend(fontsize='small')
-    plt.grid(map_makersize[3])
+    fig = Figure(dpi=600)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    # Reversed colormap instead of inverting whole bitmap
+    draw_map_image(ax, map_image, map_size, cmap=matplotlib.cm.get_cmap(map_color[0]).reversed())
+    # Map scale is limited by axes side which is shorter for map aspect
+    pixel_size = max(map_size[0] / ax.bbox.width, map_size[1] / ax.bbox.height)
+    tra_x, tra_y = decimate_line(tra_data['x_position_m'], tra_data['y_position_m'], pixel_size)
+    ax.plot(tra_x, tra_y, color=map_color[1], lw=map_makersize[0], label='Trajectory')
+    ax.plot(ref_point['x_position_m'], ref_point['y_position_m'], color=map_color[2], linestyle='None', marker='+', markersize=map_makersize[1], label='Reference')
+    ax.plot(BLE_info['x_position_m'], BLE_info['y_position_m'], color=map_color[3], linestyle='None', marker='.', markersize=map_makersize[2], label='BLE')
+    ax.set_title(f'{indicator_name}')
+    ax.set_xlabel('x [m]')
+    ax.set_ylabel('y [m]')
+    ax.legend(fontsize='small')
+    ax.grid(map_makersize[3])
     
     return fig
 
@@ -260,7 +780,8 @@ def draw_CE_map(indicator_df, map_image, map_size, indicator_name):
     Parameters
     ----------
     tra_data : list of float
-    map_image : bitmap
+    map_image : ndarray of uint8
+        bitmap, value 1 is obstacle
     map_size : float
     '''
     import matplotlib.cm as cm
@@ -270,18 +791,19 @@ def draw_CE_map(indicator_df, map_image, map_size, indicator_name):
     cmap_data[0, 3] = 0 # 0 のときのα値を0(透明)にする
     customized_cool = colors.ListedColormap(cmap_data)
 
-    fig = plt.figure(dpi=600)
+    fig = Figure(dpi=600)
+    FigureCanvasAgg(fig)
     #ax = fig.add_subplot(111)
     ax = fig.add_axes((0.05, 0.05, 0.8, 0.9))
 
-    ax.imshow(map_image, extent=[0, map_size[0], 0, map_size[1]])
+    draw_map_image(ax, map_image, map_size)
 
     error_map = calc_CE_map(indicator_df, map_size)
     X, Y = np.mgrid[0:error_map.shape[0], 0:error_map.shape[1]]
     im = ax.pcolormesh(X, Y, error_map, cmap=customized_cool)
 
     cax = fig.add_axes((0.9, 0.15, 0.03, 0.7))
-    plt.colorbar(im, cax=cax)
+    fig.colorbar(im, cax=cax)
 
     ax.set_title(f'{indicator_name}_error_map')
     ax.set_xlabel('x [m]')
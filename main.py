@@ -1,18 +1,978 @@
 # coding: utf-8
 import os
+import sys
 import glob
+import json
 import argparse
+import multiprocessing
+import hashlib
 import re
+import signal
+import tempfile
+import time
 
+from collections import defaultdict
 from logging import getLogger, Formatter, StreamHandler, FileHandler, DEBUG, INFO
-import matplotlib.pyplot as plt
 import pandas as pd
+import numpy as np
 import dataloader
 from indicator_evaluation import CalcIndicator
 
 import indicator_utils
 import utils
 
+logger = getLogger(__name__)
+
+# Manifest of inputs and results of each file for incremental evaluation
+MANIFEST_FILENAME = 'manifest.json'
+MANIFEST_VERSION = 3
+# Folder of total indicator values of each file in manifest
+MANIFEST_TOTAL_DNAME = 'manifest_total'
+# Options which change indicators or saved files of each file
+MANIFEST_OPTIONS = ['indicators', 'CE_percentile', 'CP_percentile', 'EAG_percentile', 'area_weights', 'CA_hist', 
+                    'band_width', 'kde_fft', 'kde_refine', 'velocity', 'plots']
+
+# Total indicators which are better when higher, used for ranking
+HIGHER_IS_BETTER = ['requirement_coverage']
+
+# Evaluation context of current process, set by init_worker
+worker_context = dict()
+
+def init_worker(context, figure_renderer=None, started_files=None):
+    '''
+    Set evaluation context of track for current process
+
+    Parameters
+    ----------
+    context : dictionary
+        args, track, conf, tra_dname, indicator_savedir and loaded ground truth of track
+    figure_renderer : FigureRenderer
+        renderer to queue figures, figures are rendered at once if None
+    started_files : DictProxy
+        file name -> process id of worker which started evaluating it, set by evaluate_file_safely
+    '''
+    worker_context.clear()
+    worker_context.update(context)
+    worker_context['started_files'] = started_files
+    args = context['args']
+
+    # Attach ground truth published by publish_ground_truth
+    if 'shared_paths' in context:
+        shared_arrays = dataloader.attach_arrays(context['shared_paths'])
+        worker_context['map_image'] = shared_arrays.pop('map_image')
+        worker_context['obstacle_mask'] = shared_arrays.pop('obstacle_mask')
+        worker_context['shared_points'] = shared_arrays
+    worker_context['evaluation_indicator'] = CalcIndicator(kde_fft=args.kde_fft, kde_refine=args.kde_refine, 
+                                                           draw_figure=(args.plots == 'all'))
+    worker_context['figure_renderer'] = figure_renderer or indicator_utils.FigureRenderer()
+
+def publish_ground_truth(context, tra_files, publish_dname):
+    '''
+    Publish ground truth of track as memory-mapped files for worker processes
+
+    Parameters
+    ----------
+    context : dictionary
+        evaluation context of track
+    tra_files : list of str
+    publish_dname : str
+
+    Returns
+    -------
+    shared_context : dictionary
+        evaluation context which refers published arrays instead of holding them
+    '''
+    args = context['args']
+    conf = context['conf']
+
+    arrays = {'map_image': context['map_image'], 'obstacle_mask': context['obstacle_mask']}
+    for tra_num in sorted(set(re.sub("\\D", "", tra_filename) for tra_filename in tra_files)):
+        for point_type in ['ref', 'ans']:
+            point = dataloader.load_point(conf[f'{point_type}_dname'], conf[f'{point_type}_fname'].format(tra_num), args.cache_folder)
+            if point is not None:
+                # One array per column keeps dtype of each column, e.g. integer unixtime
+                for column in ['unixtime', 'x_position_m', 'y_position_m']:
+                    arrays[f'{point_type}_{tra_num}_{column}'] = point[column].values
+
+    shared_context = {key: value for key, value in context.items() if key not in ['map_image', 'obstacle_mask']}
+    shared_context['shared_paths'] = dataloader.publish_arrays(arrays, publish_dname)
+    return shared_context
+
+def ground_truth_point(context, point_type, tra_num):
+    '''
+    Get reference or answer point of trajectory number from published arrays or file
+
+    Parameters
+    ----------
+    context : dictionary
+        evaluation context set by init_worker
+    point_type : str
+        'ref' or 'ans'
+    tra_num : str
+
+    Returns
+    -------
+    point : DataFrame
+        columns = ['unixtime', 'x_position_m', 'y_position_m'], None if file does not exist
+    '''
+    shared_points = context.get('shared_points', {})
+    columns = ['unixtime', 'x_position_m', 'y_position_m']
+    if all(f'{point_type}_{tra_num}_{column}' in shared_points for column in columns):
+        return pd.DataFrame({column: shared_points[f'{point_type}_{tra_num}_{column}'] for column in columns}, columns=columns)
+
+    conf = context['conf']
+    return dataloader.load_point(conf[f'{point_type}_dname'], conf[f'{point_type}_fname'].format(tra_num), 
+                                 context['args'].cache_folder)
+
+def evaluate_file_safely(tra_filename, file_inputs_future=None):
+    '''
+    Evaluate one trajectory file, failure is logged and does not stop other files
+
+    Parameters
+    ----------
+    tra_filename : str
+    file_inputs_future : Future
+        prefetched result of load_file_inputs, files are loaded in evaluation if None
+
+    Returns
+    -------
+    file_result : tuple or None
+        result of evaluate_file, None if evaluation failed
+    '''
+    if worker_context.get('started_files') is not None:
+        worker_context['started_files'][tra_filename] = os.getpid()
+    try:
+        file_inputs = None if file_inputs_future is None else file_inputs_future.result()
+        return evaluate_file(tra_filename, worker_context, file_inputs)
+    except Exception:
+        logger.exception('{} Evaluation FAILED'.format(tra_filename))
+        print('{} evaluation failed'.format(tra_filename))
+        return None
+
+def evaluate_files_in_pool(context, tra_files, jobs, file_timeout=None):
+    '''
+    Evaluate trajectory files in worker processes
+    File whose worker process dies (e.g. killed by out of memory) or which exceeds file_timeout fails,
+    its worker is replaced and the other files are still evaluated
+
+    Parameters
+    ----------
+    context : dictionary
+        evaluation context for init_worker
+    tra_files : list of str
+    jobs : int
+        number of worker processes
+    file_timeout : float
+        seconds to evaluate one file, worker is killed when it is exceeded. No limit if None
+
+    Returns
+    -------
+    file_results : list
+        result of evaluate_file_safely in order of tra_files, None if evaluation failed
+    '''
+    with multiprocessing.Manager() as manager:
+        started_files = manager.dict()
+        with multiprocessing.Pool(processes=jobs, initializer=init_worker, initargs=(context, None, started_files)) as pool:
+            async_results = {tra_filename: pool.apply_async(evaluate_file_safely, (tra_filename,)) for tra_filename in tra_files}
+            file_results = dict()
+            start_times = dict()
+            killed_files = set()
+            while len(file_results) < len(tra_files):
+                time.sleep(0.1)
+                started = dict(started_files)
+                alive_pids = set(process.pid for process in multiprocessing.active_children())
+                for tra_filename, async_result in async_results.items():
+                    if tra_filename in file_results or tra_filename not in started:
+                        continue
+                    if async_result.ready():
+                        file_results[tra_filename] = async_result.get()
+                    elif started[tra_filename] not in alive_pids:
+                        reason = 'timed out' if tra_filename in killed_files else 'worker process died'
+                        logger.error('{} Evaluation FAILED, {}'.format(tra_filename, reason))
+                        print('{} evaluation failed'.format(tra_filename))
+                        file_results[tra_filename] = None
+                    elif file_timeout and tra_filename not in killed_files:
+                        start_times.setdefault(tra_filename, time.time())
+                        if time.time() - start_times[tra_filename] > file_timeout:
+                            os.kill(started[tra_filename], getattr(signal, 'SIGKILL', signal.SIGTERM))
+                            killed_files.add(tra_filename)
+    return [file_results[tra_filename] for tra_filename in tra_files]
+
+def load_file_inputs(tra_filename, context):
+    '''
+    Load trajectory and ground truth files of one trajectory file
+
+    Parameters
+    ----------
+    tra_filename : str
+    context : dictionary
+        evaluation context set by init_worker
+
+    Returns
+    -------
+    file_inputs : dictionary
+        keys = ['tra_data', 'tra_num'] and keys of prepare_ground_truth
+    '''
+    args = context['args']
+
+    # Load trajectory files
+    tra_data = dataloader.load_point(context['tra_dname'], tra_filename, args.cache_folder)
+    tra_num = re.sub("\\D", "", tra_filename)
+
+    file_inputs = {'tra_data': tra_data, 'tra_num': tra_num}
+    file_inputs.update(ground_truth(context, tra_num))
+    return file_inputs
+
+def ground_truth(context, tra_num):
+    '''
+    Get prepared ground truth of trajectory number, prepared once and kept in ground_truth_cache of context
+
+    Parameters
+    ----------
+    context : dictionary
+        evaluation context set by init_worker
+    tra_num : str
+
+    Returns
+    -------
+    ground_truth : dictionary
+        result of prepare_ground_truth, DataFrames must not be modified
+    '''
+    ground_truth_cache = context.setdefault('ground_truth_cache', dict())
+    if tra_num not in ground_truth_cache:
+        ground_truth_cache[tra_num] = prepare_ground_truth(context, tra_num)
+    else:
+        logger.debug('ground truth of No{} is reused'.format(tra_num))
+    return ground_truth_cache[tra_num]
+
+def prepare_ground_truth(context, tra_num):
+    '''
+    Load ground truth files of trajectory number and prepare evaluation points from ground truth index
+
+    Parameters
+    ----------
+    context : dictionary
+        evaluation context set by init_worker
+    tra_num : str
+
+    Returns
+    -------
+    ground_truth : dictionary
+        keys = ['ref_point', 'ans_point', 'evaluation_point', 'eval_point_ALAP', 'eval_point_ALIP', 
+                'area_eval_points', 'area_weights', 'ref_time_index'],
+        area_eval_points and area_weights are None if area info does not exist
+    '''
+    conf = context['conf']
+    area_info = context['area_info']
+
+    ref_point = ground_truth_point(context, 'ref', tra_num)
+    ans_point = ground_truth_point(context, 'ans', tra_num)
+
+    def compile_index():
+        ALIP_info = dataloader.ALIP_info(conf['ALIP_dname'], conf['ALIP_info_fname'].format(tra_num))
+        return dataloader.compile_ground_truth_index(ref_point, ans_point, ALIP_info, area_info)
+
+    index_files = [os.path.join(conf['ref_dname'], conf['ref_fname'].format(tra_num)),
+                   os.path.join(conf['ans_dname'], conf['ans_fname'].format(tra_num)),
+                   os.path.join(conf['ALIP_dname'], conf['ALIP_info_fname'].format(tra_num)),
+                   os.path.join(conf['map_dname'], conf['area_fname'])]
+    index = dataloader.ground_truth_index(index_files, compile_index, context['args'].cache_folder)
+
+    # Index is sorted by time, evaluation point keeps order of answer file
+    file_order = np.argsort(index['ans_row'], kind='mergesort')
+    evaluation_point = ans_point.iloc[index['ans_row'][file_order]]
+    is_ALIP = index['is_ALIP'][file_order]
+
+    if not index['has_ALIP']:
+        eval_point_ALAP = ans_point
+        eval_point_ALIP = pd.DataFrame(index=[], columns=['unixtime', 'x_position_m', 'y_position_m'])
+    else:
+        eval_point_ALAP = evaluation_point[~is_ALIP]
+        eval_point_ALIP = evaluation_point[is_ALIP]
+
+    # Evaluation point of each area for CA
+    area_eval_points = None
+    area_weights = None
+    if area_info is not None:
+        in_area = index['in_area'][file_order]
+        area_eval_points = [evaluation_point[in_area[:, area_num]] for area_num in range(len(area_info))]
+        area_point_counts = [len(area_eval_point) for area_eval_point in area_eval_points]
+        area_weights = [area_point / sum(area_point_counts) for area_point in area_point_counts]
+
+    return {'ref_point': ref_point, 'ans_point': ans_point, 
+            'evaluation_point': evaluation_point, 'eval_point_ALAP': eval_point_ALAP, 'eval_point_ALIP': eval_point_ALIP,
+            'area_eval_points': area_eval_points, 'area_weights': area_weights, 
+            'ref_time_index': (index['unixtime'], index['ref_delta_t'])}
+
+def evaluate_file(tra_filename, context, file_inputs=None):
+    '''
+    Evaluate indicators of one trajectory file and save its csv and figures
+
+    Parameters
+    ----------
+    tra_filename : str
+    context : dictionary
+        evaluation context set by init_worker
+    file_inputs : dictionary
+        result of load_file_inputs, loaded here if None
+
+    Returns
+    -------
+    file_indicator : list of tuple
+        (indicator name, value) in order of addition to IndicatorHolder
+    total_indicator : list of tuple
+        (indicator name, Series) for total indicator
+    '''
+    args = context['args']
+    track = context['track']
+    indicator_savedir = context['indicator_savedir']
+    map_size = context['map_size']
+    map_image = context['map_image']
+    obstacle_mask = context['obstacle_mask']
+    area_info = context['area_info']
+    BLE_info = context['BLE_info']
+    map_color = context['map_color']
+    map_makersize = context['map_makersize']
+    evaluation_indicator = context['evaluation_indicator']
+    figure_renderer = context['figure_renderer']
+    draw_file_figure = args.plots == 'all'
+
+    file_indicator = []
+    total_indicator = []
+
+    logger.debug('{} Evaluation START'.format(tra_filename))
+    evaluation_indicator.clear_correspond_cache()
+    print('{} evaluation progress...'.format(tra_filename))
+
+    # Load trajectory and ground truth files
+    if file_inputs is None:
+        file_inputs = load_file_inputs(tra_filename, context)
+    tra_data = file_inputs['tra_data']
+    tra_num = file_inputs['tra_num']
+    ref_point = file_inputs['ref_point']
+    evaluation_point = file_inputs['evaluation_point']
+    eval_point_ALAP = file_inputs['eval_point_ALAP']
+    eval_point_ALIP = file_inputs['eval_point_ALIP']
+
+    file_indicator.append(('file_name', tra_filename))
+
+    """
+    if area_info:
+        which_area = indicator_utils.area_of_ans(eval_point_ALIP, area_info)
+        which_area_all.extend(which_area)
+    """
+
+    # CE
+    if 'CE' in args.indicators:
+        CE = evaluation_indicator.CE_calculation(tra_data, eval_point_ALAP)
+        CE_percentile = indicator_utils.calc_percentile(CE['CE'], args.CE_percentile)
+        file_indicator.append((f'CE{args.CE_percentile}', CE_percentile))
+
+        total_indicator.append((f'CE{args.CE_percentile}', CE['CE']))
+
+        CE_savedir = os.path.join(indicator_savedir, 'CE')
+        utils.create_dir(CE_savedir) 
+
+        indicator_utils.save_indicator(data=CE, save_dir=CE_savedir, save_filename=f'Traj_No{tra_num}_CE.csv')
+        if draw_file_figure:
+            figure_renderer.submit(CE_savedir, f'Traj_No{tra_num}_CE_histgram.png', 
+                                   indicator_utils.draw_histgram, CE['CE'], indicator_name='CE', percentile=args.CE_percentile)
+            figure_renderer.submit(CE_savedir, f'Traj_No{tra_num}_CE_map.png', 
+                                   indicator_utils.draw_CE_map, CE, map_image, map_size, indicator_name='CE')
+
+    # CP
+    if 'CP' in args.indicators:
+        CP = evaluation_indicator.CP_calculation(tra_data, eval_point_ALAP, band_width=None)
+        CP_percentile = indicator_utils.calc_percentile(CP['CP'], args.CP_percentile)
+        file_indicator.append((f'CP{args.CP_percentile}', CP_percentile))
+
+        total_indicator.append((f'CP{args.CP_percentile}', CP['CP']))
+
+        CP_savedir = os.path.join(indicator_savedir, 'CP')
+        utils.create_dir(CP_savedir) 
+
+        indicator_utils.save_indicator(data=CP, save_dir=CP_savedir, save_filename=f'Traj_No{tra_num}_CP.csv')
+        if draw_file_figure:
+            figure_renderer.submit(CP_savedir, f'Traj_No{tra_num}_CP_histgram.png', 
+                                   indicator_utils.draw_histgram, CP['CP'], indicator_name='CP', percentile=args.CP_percentile)
+
+    # Area-weighted CA
+    if 'CA' in args.indicators: 
+        if args.area_weights is None:
+            area_weights = file_inputs['area_weights']
+        else:
+            area_weights = dataloader.area_weights_config(track, args.area_weights)
+
+        if area_weights is None:
+            logger.debug('CA is calculated for whole area')
+            if args.CA_hist:
+                CA, CA_fig = evaluation_indicator.CA_2Dhistgram_calculation(tra_data, evaluation_point)
+            else:
+                CA, CA_fig = evaluation_indicator.CA_KernelDensity_calculation(tra_data, evaluation_point, band_width=None)
+            CA_df = pd.DataFrame({'CA': CA}, index=[0])
+
+        else:
+            logger.debug('CA is calculated for each area division')
+            CA, CA_df, CA_fig = evaluation_indicator.Area_weighted_CA_calculation(tra_data, evaluation_point, area_info, area_weights, args.CA_hist,
+                                                                                  area_eval_points=file_inputs['area_eval_points'])
+
+        file_indicator.append(('CA', CA))
+        CA_savedir = os.path.join(indicator_savedir, 'CA')
+        utils.create_dir(CA_savedir) 
+        indicator_utils.save_dataframe(CA_savedir, f'Traj_No{tra_num}_CA.csv', CA_df)
+
+        if isinstance(CA_fig, list):
+            for i in range(len(CA_fig)):
+                if CA_fig[i] is None:
+                    continue
+                CA_fig[i].suptitle(f'Traj_No{tra_num}_area{i+1}_CA')
+                figure_renderer.submit(CA_savedir, f'Traj_No{tra_num}_area{i+1}_CA.png', CA_fig[i])
+        elif CA_fig is not None:
+            CA_fig.suptitle(f'Traj_No{tra_num}_CA')
+            figure_renderer.submit(CA_savedir, f'Traj_No{tra_num}_CA.png', CA_fig)
+
+    # EAG
+    if 'EAG' in args.indicators and not ref_point.empty and not eval_point_ALIP.empty:
+        EAG = evaluation_indicator.EAG_calculation(tra_data, ref_point, eval_point_ALIP, 
+                                                   ref_time_index=file_inputs['ref_time_index'])
+
+        EAG_percentile = indicator_utils.calc_percentile(EAG['EAG'], args.EAG_percentile)
+        file_indicator.append((f'EAG{args.EAG_percentile}', EAG_percentile))
+
+        total_indicator.append((f'EAG{args.EAG_percentile}', EAG['EAG']))
+
+        EAG_savedir = os.path.join(indicator_savedir, 'EAG')
+        utils.create_dir(EAG_savedir) 
+
+        indicator_utils.save_indicator(data=EAG, save_dir=EAG_savedir, save_filename=f'Traj_No{tra_num}_EAG.csv')
+        if draw_file_figure:
+            figure_renderer.submit(EAG_savedir, f'Traj_No{tra_num}_EAG_histgram.png', 
+                                   indicator_utils.draw_histgram, EAG['EAG'], indicator_name='EAG', percentile=args.EAG_percentile)
+
+    # Requirement for Moving Velocity 
+    if 'requirement_velocity' in args.indicators:
+        moving_velocity_df = evaluation_indicator.requirement_moving_velocity_check(tra_data, args.velocity)
+        file_indicator.append(('requirement_velocity', moving_velocity_df['velocity'].mean()))
+        velocity_savedir = os.path.join(indicator_savedir, 'requirement_velocity')
+        utils.create_dir(velocity_savedir)
+        indicator_utils.save_dataframe(velocity_savedir, f'Traj_No{tra_num}_moving_velocity.csv', moving_velocity_df)
+
+    # Requirement for obstacle avoidance
+    if 'requirement_obstacle' in args.indicators:
+        obstacle_df = evaluation_indicator.requirement_obstacle_check(tra_data, map_image, map_size, obstacle_mask)
+        if len(obstacle_df) == 0:
+            obstacle_ratio = -1
+        else:
+            obstacle_ratio = sum(obstacle_df['obstacle_cordinate_count']) / sum(obstacle_df['check_cordinate_count'])
+
+        file_indicator.append(('requirement_obstacle', obstacle_ratio))
+        obstacle_savedir = os.path.join(indicator_savedir, 'requirement_obstacle')
+        utils.create_dir(obstacle_savedir)
+        indicator_utils.save_dataframe(obstacle_savedir, f'Traj_No{tra_num}_obstacle.csv', obstacle_df)
+
+    if 'requirement_coverage' in args.indicators:
+        eval_num = len(evaluation_point)
+        corr_num = len(evaluation_indicator.extract_correspond_point(tra_data, evaluation_point))
+        coverage = corr_num / eval_num * 100
+        file_indicator.append(('requirement_coverage', coverage))
+
+    logger.debug('{} Evaluation END, correspond cache: {}'.format(tra_filename, evaluation_indicator.correspond_cache_info()))
+
+    # Draw trajectory
+    if draw_file_figure:
+        Tra_savedir = os.path.join(indicator_savedir, 'Trajectory')
+        utils.create_dir(Tra_savedir)
+        figure_renderer.submit(Tra_savedir, f'Tra_No{tra_num}.png', indicator_utils.draw_trajectory, 
+                               tra_data, map_image, map_size, f'Trajectory_No{tra_num}', ref_point, BLE_info, map_color, map_makersize)
+
+
+    return file_indicator, total_indicator
+
+def summarize_track(args, indicator_holder, indicator_savedir, figure_renderer):
+    '''
+    Save file and total indicators of track and draw total figures
+
+    Parameters
+    ----------
+    args : Namespace
+        indicators, CE_percentile, EAG_percentile and plots are used
+    indicator_holder : IndicatorHolder
+        indicators of all files of track
+    indicator_savedir : str
+    figure_renderer : FigureRenderer
+
+    Returns
+    -------
+    total_indicator : DataFrame
+    '''
+    # Show each file's results
+    file_indicator_summary = indicator_holder.summarize_file_indicator()
+    utils.stdout_dataframe(file_indicator_summary, title='file indicator')
+    utils.save_csv(save_file=file_indicator_summary, save_dir=indicator_savedir, save_filename='file_indicator.csv')
+
+    # Show total results
+    total_indicator = indicator_holder.summarize_total_indicator()
+    utils.stdout_dataframe(total_indicator, title='total indicator')
+    utils.save_csv(save_file=total_indicator, save_dir=indicator_savedir, save_filename='total_indicator.csv')
+
+    # Draw histgram and cumulative sum for total CE and EAG
+    if 'CE' in args.indicators and args.plots != 'none' and f'CE{args.CE_percentile}' in indicator_holder.indicator_total:
+        CE_savedir = os.path.join(indicator_savedir, 'CE')
+        CE_total, CE_weights = indicator_holder.total_indicator_values(f'CE{args.CE_percentile}')
+        CE_total_percentile = indicator_holder.total_indicator_percentile(f'CE{args.CE_percentile}', args.CE_percentile)
+        figure_renderer.submit(CE_savedir, 'CE_total_histgram.png', 
+                               indicator_utils.draw_histgram, CE_total, indicator_name='CE', percentile=args.CE_percentile,
+                               weights=CE_weights, percentile_value=CE_total_percentile)
+        figure_renderer.submit(CE_savedir, 'CE_total_cumulative_sum.png', 
+                               indicator_utils.draw_cumulative_sum, CE_total, 'CE', weights=CE_weights)
+
+    if 'EAG' in args.indicators and args.plots != 'none' and f'EAG{args.EAG_percentile}' in indicator_holder.indicator_total:
+        EAG_savedir = os.path.join(indicator_savedir, 'EAG')
+        EAG_total, EAG_weights = indicator_holder.total_indicator_values(f'EAG{args.EAG_percentile}')
+        EAG_total_percentile = indicator_holder.total_indicator_percentile(f'EAG{args.EAG_percentile}', args.EAG_percentile)
+        figure_renderer.submit(EAG_savedir, 'EAG_total_histgram.png', 
+                               indicator_utils.draw_histgram, EAG_total, indicator_name='EAG', percentile=args.EAG_percentile,
+                               weights=EAG_weights, percentile_value=EAG_total_percentile)
+        figure_renderer.submit(EAG_savedir, 'EAG_total_cumulative_sum.png', 
+                               indicator_utils.draw_cumulative_sum, EAG_total, 'EAG', weights=EAG_weights)
+
+    return total_indicator
+
+def track_input_hash(args, conf, data_config_path):
+    '''
+    Hash inputs shared by all files of track, ground truth config, map, BLE info and evaluation options
+
+    Parameters
+    ----------
+    args : Namespace
+    conf : dictionary
+    data_config_path : str
+
+    Returns
+    -------
+    track_hash : str
+    '''
+    file_paths = [data_config_path, os.path.join(conf['BLE_dname'], conf['BLE_info_fname'])]
+    file_paths.extend(os.path.join(conf['map_dname'], conf[key]) for key in ['map_image_fname', 'map_size_fname', 'area_fname'])
+    if args.area_weights:
+        file_paths.append(args.area_weights)
+    options = json.dumps({key: getattr(args, key) for key in MANIFEST_OPTIONS}, sort_keys=True)
+    return hashlib.md5('{}{}{}'.format(MANIFEST_VERSION, dataloader.file_hash(file_paths), options).encode('utf-8')).hexdigest()
+
+def file_input_hash(track_hash, context, tra_filename):
+    '''
+    Hash inputs of one trajectory file, trajectory, reference, answer and ALIP info files with track inputs
+
+    Parameters
+    ----------
+    track_hash : str
+        result of track_input_hash
+    context : dictionary
+        evaluation context of track
+    tra_filename : str
+
+    Returns
+    -------
+    input_hash : str
+    '''
+    conf = context['conf']
+    tra_num = re.sub("\\D", "", tra_filename)
+    file_paths = [os.path.join(context['tra_dname'], tra_filename), 
+                  os.path.join(conf['ref_dname'], conf['ref_fname'].format(tra_num)),
+                  os.path.join(conf['ans_dname'], conf['ans_fname'].format(tra_num)),
+                  os.path.join(conf['ALIP_dname'], conf['ALIP_info_fname'].format(tra_num))]
+    return hashlib.md5((track_hash + dataloader.file_hash(file_paths)).encode('utf-8')).hexdigest()
+
+def load_manifest(result_basedir, track_hash):
+    '''
+    Load manifest of last run saved by save_manifest
+
+    Parameters
+    ----------
+    result_basedir : str
+    track_hash : str
+        result of track_input_hash, manifest of other track inputs is not used
+
+    Returns
+    -------
+    manifest_files : dictionary
+        file name -> {'input_hash', 'file_state'}, empty if there is no manifest to use.
+        total_indicator of file_state is list of indicator names whose values are saved in MANIFEST_TOTAL_DNAME
+    '''
+    manifest_path = os.path.join(result_basedir, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        logger.debug('{} does not exist'.format(manifest_path))
+        return dict()
+
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != MANIFEST_VERSION or manifest.get('track_hash') != track_hash:
+        logger.debug('{} is made from other inputs of track'.format(manifest_path))
+        return dict()
+    return manifest['files']
+
+def save_manifest(result_basedir, track_hash, manifest_files):
+    manifest = {'version': MANIFEST_VERSION, 'track_hash': track_hash, 'files': manifest_files}
+    utils.save_json(manifest, result_basedir, MANIFEST_FILENAME)
+
+    # Values of files which are no longer in manifest
+    total_dname = os.path.join(result_basedir, MANIFEST_TOTAL_DNAME)
+    total_filenames = set('{}.npz'.format(manifest_file['input_hash']) for manifest_file in manifest_files.values())
+    for total_filename in os.listdir(total_dname):
+        if total_filename not in total_filenames:
+            os.remove(os.path.join(total_dname, total_filename))
+
+def save_total_values(file_states, save_dir, save_filename):
+    '''
+    Save total indicator values of file states in one .npz file, so that json of file states keeps only file indicators
+
+    Parameters
+    ----------
+    file_states : list of dictionary
+        result of IndicatorHolder.file_state with file_name
+    save_dir : str
+    save_filename : str
+
+    Returns
+    -------
+    file_records : list of dictionary
+        file states whose total_indicator is list of indicator names, restored by load_total_values
+    '''
+    total_values = dict()
+    file_records = []
+    for file_num, file_state in enumerate(file_states):
+        for indicator_name, values in file_state['total_indicator']:
+            total_values['{}_{}'.format(file_num, indicator_name)] = values
+        file_records.append(dict(file_state, total_indicator=[indicator_name for indicator_name, _ in file_state['total_indicator']]))
+    np.savez(os.path.join(save_dir, save_filename), **total_values)
+    return file_records
+
+def load_total_values(file_records, save_dir, save_filename):
+    '''
+    Restore file states saved by save_total_values
+
+    Parameters
+    ----------
+    file_records : list of dictionary
+    save_dir : str
+    save_filename : str
+
+    Returns
+    -------
+    file_states : list of dictionary
+    '''
+    with np.load(os.path.join(save_dir, save_filename)) as total_values:
+        return [dict(file_record, total_indicator=[[indicator_name, total_values['{}_{}'.format(file_num, indicator_name)]] 
+                                                   for indicator_name in file_record['total_indicator']])
+                for file_num, file_record in enumerate(file_records)]
+
+def parse_shard(shard):
+    '''
+    Parse shard option "i/N", i is from 0 to N-1
+    '''
+    match = re.fullmatch('(\\d+)/(\\d+)', shard)
+    if match is None or int(match.group(1)) >= int(match.group(2)):
+        raise argparse.ArgumentTypeError('shard should be i/N with 0 <= i < N')
+    return int(match.group(1)), int(match.group(2))
+
+def shard_filename(shard, extension='.json'):
+    return 'shard_{}_of_{}{}'.format(*shard, extension)
+
+def save_shard_state(args, track, all_tra_files, file_states, result_basedir):
+    '''
+    Save indicators of files in shard to be merged by merge command
+    File indicators are saved in json and total indicator values in .npz file of same name
+
+    Parameters
+    ----------
+    args : Namespace
+    track : str
+    all_tra_files : list of str
+        trajectory files of all shards, order of merged result
+    file_states : list of dictionary
+        result of IndicatorHolder.file_state with file_name
+    result_basedir : str
+    '''
+    shard_state = {'track': track, 'shard': list(args.shard), 'tra_files': all_tra_files, 
+                   'indicators': args.indicators, 'CE_percentile': args.CE_percentile, 'EAG_percentile': args.EAG_percentile,
+                   'exact_total': args.exact_total, 'sketch_size': args.sketch_size, 'exact_limit': args.exact_limit, 
+                   'total_file': shard_filename(args.shard, '.npz'),
+                   'files': save_total_values(file_states, result_basedir, shard_filename(args.shard, '.npz'))}
+    utils.save_json(shard_state, result_basedir, shard_filename(args.shard))
+    print('{} files of shard {}/{} are saved'.format(len(file_states), *args.shard))
+
+def merge(args):
+    '''
+    Merge shard states saved by --shard into file and total indicators of each track
+    Result is same as evaluation of all files at once
+
+    Parameters
+    ----------
+    args : Namespace
+        shard_files, save_folder and plots
+    '''
+    shard_states = defaultdict(list)
+    for shard_file in args.shard_files:
+        with open(shard_file) as f:
+            shard_state = json.load(f)
+        # Total indicator values are in .npz file next to json
+        shard_state['files'] = load_total_values(shard_state['files'], os.path.dirname(shard_file), shard_state['total_file'])
+        shard_states[shard_state['track']].append(shard_state)
+
+    option_keys = ['tra_files', 'indicators', 'CE_percentile', 'EAG_percentile', 'exact_total', 'sketch_size', 'exact_limit']
+    for track, states in shard_states.items():
+        logger.debug('- {} merge START -'.format(track))
+
+        # All shards of one evaluation are needed
+        shard_num = states[0]['shard'][1]
+        shard_indexes = sorted(state['shard'][0] for state in states)
+        if shard_indexes != list(range(shard_num)) or any(state['shard'][1] != shard_num for state in states):
+            raise ValueError('{} shards {} are not complete shards of {}'.format(track, shard_indexes, shard_num))
+        for state in states[1:]:
+            for key in option_keys:
+                if state[key] != states[0][key]:
+                    raise ValueError('{} shards are evaluated with different {}'.format(track, key))
+
+        track_args = argparse.Namespace(**{key: states[0][key] for key in option_keys})
+        track_args.plots = args.plots
+
+        indicator_holder = indicator_utils.IndicatorHolder(exact_total=track_args.exact_total, sketch_size=track_args.sketch_size,
+                                                           exact_limit=track_args.exact_limit)
+        file_order = {tra_filename: i for i, tra_filename in enumerate(track_args.tra_files)}
+        file_states = sorted((file_state for state in states for file_state in state['files']), 
+                             key=lambda file_state: file_order[file_state['file_name']])
+        for file_state in file_states:
+            indicator_holder.add_file_state(file_state)
+
+        result_basedir = os.path.join(args.save_folder, track)
+        indicator_savedir = os.path.join(result_basedir, 'indicator')
+        for dir_path in [args.save_folder, result_basedir, indicator_savedir]:
+            utils.create_dir(dir_path)
+        for indicator_name in ['CE', 'EAG']:
+            if indicator_name in track_args.indicators and args.plots != 'none':
+                utils.create_dir(os.path.join(indicator_savedir, indicator_name))
+
+        summarize_track(track_args, indicator_holder, indicator_savedir, indicator_utils.FigureRenderer())
+        logger.debug('- {} merge END -'.format(track))
+
+def load_track(args, track):
+    '''
+    Load ground truth of track which is shared by all trajectory folders
+
+    Parameters
+    ----------
+    args : Namespace
+    track : str
+
+    Returns
+    -------
+    track_context : dictionary
+        args, track, conf, data_config_path, loaded ground truth of track 
+        and ground_truth_cache which keeps result of ground_truth for each trajectory number
+    '''
+    # Load data config 
+    data_config_path = glob.glob(os.path.join(args.ground_truth_folder, '*.ini'))[0]
+    conf = dataloader.config(track, args.ground_truth_folder, config_file=data_config_path)
+
+    # Load groundtruth files
+    map_size = dataloader.map_size(conf['map_dname'], conf['map_size_fname'])
+    map_image, obstacle_mask = dataloader.map_artifacts(conf['map_dname'], conf['map_image_fname'], 
+                                                        conf['map_size_fname'], conf['area_fname'], args.cache_folder)
+    area_info = dataloader.area_info(conf['map_dname'], conf['area_fname'])     
+    BLE_info = dataloader.BLE_info(conf['BLE_dname'], conf['BLE_info_fname'])     
+    map_color = dataloader.map_color(conf['map_obstacle_color'], conf['map_trajectory_color'], conf['map_ref_color'], conf['map_BLE_color'])
+    map_makersize = dataloader.map_makersize(conf['map_trajectory_size'], conf['map_ref_size'], conf['map_BLE_size'], conf['map_grid'])
+
+    return {'args': args, 'track': track, 'conf': conf, 'data_config_path': data_config_path,
+            'map_size': map_size, 'map_image': map_image, 'obstacle_mask': obstacle_mask, 'area_info': area_info, 
+            'BLE_info': BLE_info, 'map_color': map_color, 'map_makersize': map_makersize, 'ground_truth_cache': dict()}
+
+def evaluate_track(track_context, tra_dname, result_basedir):
+    '''
+    Evaluate trajectory files of one trajectory folder and save results
+
+    Parameters
+    ----------
+    track_context : dictionary
+        result of load_track
+    tra_dname : str
+        trajectory folder of track
+    result_basedir : str
+
+    Returns
+    -------
+    total_indicator : DataFrame
+        total indicators of track, None if only shard is evaluated
+    evaluated_files : list of str
+        trajectory files whose results are summarized
+    '''
+    args = track_context['args']
+    track = track_context['track']
+    conf = track_context['conf']
+    map_image = track_context['map_image']
+    logger.debug('tra_dname:{}'.format(tra_dname))
+
+    indicator_savedir = os.path.join(result_basedir, 'indicator') 
+    for dir_path in [result_basedir, indicator_savedir]:
+        utils.create_dir(dir_path)
+
+    extension_types = ['*.txt', '*.csv']
+    tra_files = []
+    for ext_type in extension_types:
+        keyword = os.path.join(tra_dname, ext_type)
+        tra_files.extend([os.path.split(file_path)[-1] for file_path in sorted(glob.glob(keyword, recursive=True))])
+
+    if args.file:
+        tra_files = args.file
+
+    # Each shard evaluates every N-th file of sorted file list
+    all_tra_files = tra_files
+    if args.shard:
+        tra_files = all_tra_files[args.shard[0]::args.shard[1]]
+
+    logger.debug('trajection files:{}'.format(tra_files))
+
+    indicator_holder = indicator_utils.IndicatorHolder(exact_total=args.exact_total, sketch_size=args.sketch_size, 
+                                                       exact_limit=args.exact_limit)
+
+    # Evaluation context shared by all files of the track
+    context = dict(track_context, tra_dname=tra_dname, indicator_savedir=indicator_savedir)
+
+    # Figures are rendered in worker processes while files are evaluated
+    figure_renderer = indicator_utils.FigureRenderer()
+    figure_publish = None
+    if args.plot_jobs > 0 and args.jobs == 1 and args.plots != 'none':
+        figure_publish = tempfile.TemporaryDirectory(prefix='figure_')
+        shared_arrays = {'map_image': map_image}
+        figure_renderer = indicator_utils.FigureRenderer(args.plot_jobs, shared_arrays,
+                                                         dataloader.publish_arrays(shared_arrays, figure_publish.name))
+    elif args.plot_jobs > 0:
+        logger.debug('plot_jobs is ignored, figures are rendered in evaluation processes')
+
+    # Files whose inputs are unchanged since last run reuse saved results
+    reused_states = dict()
+    if args.incremental:
+        track_hash = track_input_hash(args, conf, track_context['data_config_path'])
+        input_hashes = {tra_filename: file_input_hash(track_hash, context, tra_filename) for tra_filename in tra_files}
+        manifest_files = load_manifest(result_basedir, track_hash)
+        total_dname = os.path.join(result_basedir, MANIFEST_TOTAL_DNAME)
+        utils.create_dir(total_dname)
+        for tra_filename in tra_files:
+            input_hash = input_hashes[tra_filename]
+            total_filename = '{}.npz'.format(input_hash)
+            if manifest_files.get(tra_filename, {}).get('input_hash') == input_hash \
+                    and os.path.exists(os.path.join(total_dname, total_filename)):
+                reused_states[tra_filename] = load_total_values([manifest_files[tra_filename]['file_state']], 
+                                                                total_dname, total_filename)[0]
+        print('{} files are reused, {} files are evaluated'.format(len(reused_states), len(tra_files) - len(reused_states)))
+    evaluate_files = [tra_filename for tra_filename in tra_files if tra_filename not in reused_states]
+
+    if args.jobs > 1:
+        # Workers attach to ground truth published once as memory-mapped files
+        with tempfile.TemporaryDirectory(prefix='ground_truth_') as publish_dname:
+            shared_context = publish_ground_truth(context, evaluate_files, publish_dname)
+            file_results = evaluate_files_in_pool(shared_context, evaluate_files, args.jobs, args.file_timeout)
+    elif args.prefetch > 0:
+        # Next files are loaded on background thread while current file is evaluated
+        init_worker(context, figure_renderer)
+        file_results = [evaluate_file_safely(tra_filename, file_inputs_future) for tra_filename, file_inputs_future
+                        in dataloader.prefetch(lambda f: load_file_inputs(f, worker_context), evaluate_files, args.prefetch)]
+    else:
+        init_worker(context, figure_renderer)
+        file_results = [evaluate_file_safely(tra_filename) for tra_filename in evaluate_files]
+    file_results = dict(zip(evaluate_files, file_results))
+
+    # Merge each file's results in file order
+    file_states = []
+    for tra_filename in tra_files:
+        if tra_filename in reused_states:
+            file_states.append(reused_states[tra_filename])
+            continue
+        if file_results[tra_filename] is None:
+            logger.debug('{} is skipped from summary'.format(tra_filename))
+            continue
+        file_state = indicator_holder.file_state(*file_results[tra_filename])
+        file_state['file_name'] = tra_filename
+        file_states.append(file_state)
+
+    if args.incremental:
+        # Files out of this run (e.g. not selected by --file) are kept for next run
+        last_manifest_files = manifest_files
+        manifest_files = {tra_filename: manifest_file for tra_filename, manifest_file in manifest_files.items() 
+                          if tra_filename not in tra_files}
+        for file_state in file_states:
+            tra_filename = file_state['file_name']
+            if tra_filename in reused_states:
+                manifest_files[tra_filename] = last_manifest_files[tra_filename]
+                continue
+            input_hash = input_hashes[tra_filename]
+            file_record = save_total_values([file_state], total_dname, '{}.npz'.format(input_hash))[0]
+            manifest_files[tra_filename] = {'input_hash': input_hash, 'file_state': file_record}
+        save_manifest(result_basedir, track_hash, manifest_files)
+
+    total_indicator = None
+    if args.shard:
+        save_shard_state(args, track, all_tra_files, file_states, result_basedir)
+    else:
+        for file_state in file_states:
+            indicator_holder.add_file_state(file_state)
+        total_indicator = summarize_track(args, indicator_holder, indicator_savedir, figure_renderer)
+
+    # Wait for all figures of track before removing published map
+    figure_renderer.shutdown()
+    if figure_publish is not None:
+        figure_publish.cleanup()
+
+    return total_indicator, [file_state['file_name'] for file_state in file_states]
+
+def ground_truth_numbers(conf):
+    '''
+    Trajectory numbers which have ground truth answer file
+
+    Parameters
+    ----------
+    conf : dictionary
+        data config of track
+
+    Returns
+    -------
+    tra_nums : list of str
+    '''
+    prefix, suffix = conf['ans_fname'].split('{}')
+    pattern = re.compile('{}(\\d+){}'.format(re.escape(prefix), re.escape(suffix)))
+    tra_nums = []
+    for file_path in sorted(glob.glob(os.path.join(conf['ans_dname'], conf['ans_fname'].format('*')))):
+        match = pattern.fullmatch(os.path.basename(file_path))
+        if match:
+            tra_nums.append(match.group(1))
+    return tra_nums
+
+def rank_submissions(total_indicators, rank_by):
+    '''
+    Rank total indicators of submissions
+
+    Parameters
+    ----------
+    total_indicators : list of DataFrame
+        total indicator of each submission with 'track', 'team', 'evaluated_files' and 'expected_files' columns
+    rank_by : str
+        total indicator column to rank, smaller is better except HIGHER_IS_BETTER
+
+    Returns
+    -------
+    ranking : DataFrame
+        total indicators sorted by rank, incomplete submissions are ranked after all complete submissions
+    '''
+    ranking = pd.concat(total_indicators, ignore_index=True)
+    if rank_by not in ranking.columns:
+        raise ValueError('{} is not in total indicators {}'.format(rank_by, list(ranking.columns)))
+    complete = ranking['evaluated_files'] >= ranking['expected_files']
+    ascending = rank_by not in HIGHER_IS_BETTER
+    rank = ranking[rank_by].where(complete).rank(method='min', ascending=ascending)
+    incomplete_rank = ranking[rank_by].where(~complete).rank(method='min', ascending=ascending) + complete.sum()
+    ranking.insert(2, 'rank', rank.fillna(incomplete_rank).astype('Int64'))
+    return ranking.sort_values('rank', kind='mergesort').reset_index(drop=True)
+
 def main(args):
     # File output handler for save folder
     if args.save_folder:
@@ -22,227 +982,61 @@ def main(args):
         file_handler2.setFormatter(formatter)
         logger.addHandler(file_handler2)
 
+    rankings = []
     for track in args.track:
         logger.debug('- {}, {} evaluation START -'.format(args.trajection_folder, track))
-        
-        # Load data config 
-        data_config_path = glob.glob(os.path.join(args.ground_truth_folder, '*.ini'))[0]
-        conf = dataloader.config(track, args.ground_truth_folder, config_file=data_config_path)
-
-        # Directory path to evaluate
-        tra_dname = os.path.join(args.trajection_folder, track)
-        logger.debug('tra_dname:{}'.format(tra_dname))
-
-        # Load groundtruth files
-        map_size = dataloader.map_size(conf['map_dname'], conf['map_size_fname'])
-        map_image = dataloader.map_image(conf['map_dname'], conf['map_image_fname'])    
-        area_info = dataloader.area_info(conf['map_dname'], conf['area_fname'])     
-        BLE_info = dataloader.BLE_info(conf['BLE_dname'], conf['BLE_info_fname'])     
-        map_color = dataloader.map_color(conf['map_obstacle_color'], conf['map_trajectory_color'], conf['map_ref_color'], conf['map_BLE_color'])
-        map_makersize = dataloader.map_makersize(conf['map_trajectory_size'], conf['map_ref_size'], conf['map_BLE_size'], conf['map_grid'])
-
-        # Create result save directory
-        if args.save_folder:
-            result_basedir = os.path.join(args.save_folder, track)
-        else:
-            result_basedir = os.path.join(tra_dname, 'result')
-        indicator_savedir = os.path.join(result_basedir, 'indicator') 
-        
-        for dir_path in [result_basedir, indicator_savedir]:
-            utils.create_dir(dir_path)
 
-        extension_types = ['*.txt', '*.csv']
-        tra_files = []
-        for ext_type in extension_types:
-            keyword = os.path.join(tra_dname, ext_type)
-            tra_files.extend([os.path.split(file_path)[-1] for file_path in sorted(glob.glob(keyword, recursive=True))])
-            
-        if args.file:
-            tra_files = args.file
-
-        logger.debug('trajection files:{}'.format(tra_files))
-
-        # Instance to calculate indicator
-        evaluation_indicator = CalcIndicator()
-        indicator_holder = indicator_utils.IndicatorHolder()
-        
-        for tra_filename in tra_files:
-            logger.debug('{} Evaluation START'.format(tra_filename))
-            print('{} evaluation progress...'.format(tra_filename))
- 
-            # Load trajectory files
-            tra_data = dataloader.load_point(tra_dname, tra_filename)
-            tra_num = re.sub("\\D", "", tra_filename)
-
-            # Load ground truth files
-            ref_point = dataloader.load_point(conf['ref_dname'], conf['ref_fname'].format(tra_num))
-            ans_point = dataloader.load_point(conf['ans_dname'], conf['ans_fname'].format(tra_num))
-            ALIP_info = dataloader.ALIP_info(conf['ALIP_dname'], conf['ALIP_info_fname'].format(tra_num))
-
-            indicator_holder.add_indicator_percentile('file_name', tra_filename)
-
-            # prepare evaluation point
-            if ref_point is None:
-                evaluation_point = ans_point
-            else:
-                evaluation_point = dataloader.drop_ans_duplicated_with_ref(ans_point, ref_point)
+        # Ground truth is loaded once for all trajectory folders
+        track_context = load_track(args, track)
 
-            if ALIP_info is None:
-                eval_point_ALAP = ans_point
-                eval_point_ALIP = pd.DataFrame(index=[], columns=['unixtime', 'x_position_m', 'y_position_m'])
-            else:
-                eval_point_ALAP = dataloader.filter_evaluation_data_ALIP(evaluation_point, ALIP_info, ALIP_flag=False)
-                eval_point_ALIP = dataloader.filter_evaluation_data_ALIP(evaluation_point, ALIP_info, ALIP_flag=True)
-                 
-            """
-            if area_info:
-                which_area = indicator_utils.area_of_ans(eval_point_ALIP, area_info)
-                which_area_all.extend(which_area)
-            """
-
-            # CE
-            if 'CE' in args.indicators:
-                CE = evaluation_indicator.CE_calculation(tra_data, eval_point_ALAP)
-                CE_percentile = indicator_utils.calc_percentile(CE['CE'], args.CE_percentile)
-                indicator_holder.add_indicator_percentile(f'CE{args.CE_percentile}', CE_percentile)
-
-                indicator_holder.add_total_indicator(f'CE{args.CE_percentile}', CE['CE'])
-
-                indicator_utils.calc_CE_map(CE, map_size)
-                CE_savedir = os.path.join(indicator_savedir, 'CE')
-                utils.create_dir(CE_savedir) 
-
-                indicator_utils.save_indicator(data=CE, save_dir=CE_savedir, save_filename=f'Traj_No{tra_num}_CE.csv')
-                CE_hist = indicator_utils.draw_histgram(data=CE['CE'], indicator_name='CE', percentile=args.CE_percentile)
-                indicator_utils.save_figure(CE_hist, save_dir=CE_savedir, save_filename=f'Traj_No{tra_num}_CE_histgram.png')
-            
-                CE_map = indicator_utils.draw_CE_map(CE, map_image, map_size, indicator_name='CE')
-                indicator_utils.save_figure(CE_map, save_dir=CE_savedir, save_filename=f'Traj_No{tra_num}_CE_map.png')
-
-            # CP
-            if 'CP' in args.indicators:
-                CP = evaluation_indicator.CP_calculation(tra_data, eval_point_ALAP, band_width=None)
-                CP_percentile = indicator_utils.calc_percentile(CP['CP'], args.CP_percentile)
-                indicator_holder.add_indicator_percentile(f'CP{args.CP_percentile}', CP_percentile)
-
-                indicator_holder.add_total_indicator(f'CP{args.CP_percentile}', CP['CP'])
-
-                CP_savedir = os.path.join(indicator_savedir, 'CP')
-                utils.create_dir(CP_savedir) 
-
-                indicator_utils.save_indicator(data=CP, save_dir=CP_savedir, save_filename=f'Traj_No{tra_num}_CP.csv')
-                CP_hist = indicator_utils.draw_histgram(data=CP['CP'], indicator_name='CP', percentile=args.CP_percentile)
-                indicator_utils.save_figure(CP_hist, save_dir=CP_savedir, save_filename=f'Traj_No{tra_num}_CP_histgram.png')
-
-            # Area-weighted CA
-            if 'CA' in args.indicators: 
-                if args.area_weights is None:
-                    area_weights = indicator_utils.get_CA_area_weights(evaluation_point, area_info)
-                else:
-                    area_weights = dataloader.area_weights_config(track, args.area_weights)
-                
-                if area_weights is None:
-                    logger.debug('CA is calculated for whole area')
-                    if args.CA_hist:
-                        CA, CA_fig = evaluation_indicator.CA_2Dhistgram_calculation(tra_data, evaluation_point)
-                    else:
-                        CA, CA_fig = evaluation_indicator.CA_KernelDensity_calculation(tra_data, evaluation_point, band_width=None)
-                    CA_df = pd.DataFrame({'CA': CA}, index=[0])
-                
+        if args.leaderboard:
+            # Each subfolder of trajection folder is a submission which has track folder
+            teams = sorted(team for team in os.listdir(args.trajection_folder) 
+                           if os.path.isdir(os.path.join(args.trajection_folder, team, track)))
+            # Submission is complete when all trajectories with ground truth are evaluated
+            expected_nums = ground_truth_numbers(track_context['conf'])
+            if args.file:
+                expected_nums = sorted(set(expected_nums) & set(re.sub("\\D", "", tra_filename) for tra_filename in args.file))
+            total_indicators = []
+            for team in teams:
+                print('-------- {} {} --------'.format(team, track))
+                tra_dname = os.path.join(args.trajection_folder, team, track)
+                if args.save_folder:
+                    utils.create_dir(os.path.join(args.save_folder, team))
+                    result_basedir = os.path.join(args.save_folder, team, track)
                 else:
-                    logger.debug('CA is calculated for each area division')
-                    CA, CA_df, CA_fig = evaluation_indicator.Area_weighted_CA_calculation(tra_data, evaluation_point, area_info, area_weights, args.CA_hist)
-                
-                indicator_holder.add_indicator_percentile('CA', CA)
-                CA_savedir = os.path.join(indicator_savedir, 'CA')
-                utils.create_dir(CA_savedir) 
-                indicator_utils.save_dataframe(CA_savedir, f'Traj_No{tra_num}_CA.csv', CA_df)
-                       
-                if isinstance(CA_fig, list):
-                    for i in range(len(CA_fig)):
-                        CA_fig[i].suptitle(f'Traj_No{tra_num}_area{i+1}_CA')
-                        indicator_utils.save_figure(CA_fig[i], save_dir=CA_savedir, save_filename=f'Traj_No{tra_num}_area{i+1}_CA.png')        
-                else:
-                    CA_fig.suptitle(f'Traj_No{tra_num}_CA')
-                    indicator_utils.save_figure(CA_fig, save_dir=CA_savedir, save_filename=f'Traj_No{tra_num}_CA.png')
-                
-            # EAG
-            if 'EAG' in args.indicators and not ref_point.empty and not eval_point_ALIP.empty:
-                EAG = evaluation_indicator.EAG_calculation(tra_data, ref_point, eval_point_ALIP) 
-
-                EAG_percentile = indicator_utils.calc_percentile(EAG['EAG'], args.EAG_percentile)
-                indicator_holder.add_indicator_percentile(f'EAG{args.EAG_percentile}', EAG_percentile)
-
-                indicator_holder.add_total_indicator(f'EAG{args.EAG_percentile}', EAG['EAG'])
-
-                EAG_savedir = os.path.join(indicator_savedir, 'EAG')
-                utils.create_dir(EAG_savedir) 
-                
-                indicator_utils.save_indicator(data=EAG, save_dir=EAG_savedir, save_filename=f'Traj_No{tra_num}_EAG.csv')
-                EAG_hist = indicator_utils.draw_histgram(data=EAG['EAG'], indicator_name='EAG', percentile=args.EAG_percentile)
-                indicator_utils.save_figure(EAG_hist, save_dir=EAG_savedir, save_filename=f'Traj_No{tra_num}_EAG_histgram.png')
-
-            # Requirement for Moving Velocity 
-            if 'requirement_velocity' in args.indicators:
-                moving_velocity_df = evaluation_indicator.requirement_moving_velocity_check(tra_data, args.velocity)
-                indicator_holder.add_indicator_percentile('requirement_velocity', moving_velocity_df['velocity'].mean())
-                velocity_savedir = os.path.join(indicator_savedir, 'requirement_velocity')
-                utils.create_dir(velocity_savedir)
-                indicator_utils.save_dataframe(velocity_savedir, f'Traj_No{tra_num}_moving_velocity.csv', moving_velocity_df)
-
-            # Requirement for obstacle avoidance
-            if 'requirement_obstacle' in args.indicators:
-                obstacle_df = evaluation_indicator.requirement_obstacle_check(tra_data, map_image, map_size)
-                if len(obstacle_df) == 0:
-                    obstacle_ratio = -1
-                else:
-                    obstacle_ratio = sum(obstacle_df['obstacle_cordinate_count']) / sum(obstacle_df['check_cordinate_count'])
-            
-                indicator_holder.add_indicator_percentile('requirement_obstacle', obstacle_ratio)
-                obstacle_savedir = os.path.join(indicator_savedir, 'requirement_obstacle')
-                utils.create_dir(obstacle_savedir)
-                indicator_utils.save_dataframe(obstacle_savedir, f'Traj_No{tra_num}_obstacle.csv', obstacle_df)
-
-            if 'requirement_coverage' in args.indicators:
-                eval_num = len(evaluation_point)
-                corr_num = len(evaluation_indicator.extract_correspond_point(tra_data, evaluation_point))
-                coverage = corr_num / eval_num * 100
-                indicator_holder.add_indicator_percentile('requirement_coverage', coverage)
-
-            logger.debug('{} Evaluation END'.format(tra_filename))
-
-            # Draw trajectory
-            Tra_savedir = os.path.join(indicator_savedir, 'Trajectory')
-            utils.create_dir(Tra_savedir)
-            Trajectory_image = indicator_utils.draw_trajectory(tra_data, map_image, map_size, f'Trajectory_No{tra_num}', ref_point, BLE_info, map_color, map_makersize)
-            indicator_utils.save_figure(Trajectory_image, save_dir=Tra_savedir, save_filename=f'Tra_No{tra_num}.png')
-
-        # Show each file's results
-        file_indicator_summary = indicator_holder.summarize_file_indicator()
-        utils.stdout_dataframe(file_indicator_summary, title='file indicator')
-        utils.save_csv(save_file=file_indicator_summary, save_dir=indicator_savedir, save_filename='file_indicator.csv')
-
-        # Show total results
-        total_indicator = indicator_holder.summarize_total_indicator()
-        utils.stdout_dataframe(total_indicator, title='total indicator')
-        utils.save_csv(save_file=total_indicator, save_dir=indicator_savedir, save_filename='total_indicator.csv')
-        
-        # Draw histgram and cumulative sum for total CE and EAG
-        if 'CE' in args.indicators:
-            CE_total = indicator_holder.indicator_total[f'CE{args.CE_percentile}']
-            CE_total_hist = indicator_utils.draw_histgram(data=CE_total, indicator_name='CE', percentile=args.CE_percentile)
-            indicator_utils.save_figure(CE_total_hist, save_dir=CE_savedir, save_filename='CE_total_histgram.png')
-            CE_cumulative_sum = indicator_utils.draw_cumulative_sum(CE_total.values.tolist(), 'CE')
-            indicator_utils.save_figure(CE_cumulative_sum, save_dir=CE_savedir, save_filename='CE_total_cumulative_sum.png')
-
-        if 'EAG' in args.indicators:
-            EAG_total = indicator_holder.indicator_total[f'EAG{args.EAG_percentile}']
-            EAG_total_hist = indicator_utils.draw_histgram(data=EAG_total, indicator_name='EAG', percentile=args.EAG_percentile)
-            indicator_utils.save_figure(EAG_total_hist, save_dir=EAG_savedir, save_filename='EAG_total_histgram.png')
-            EAG_cumulative_sum = indicator_utils.draw_cumulative_sum(EAG_total.values.tolist(), 'EAG')
-            indicator_utils.save_figure(EAG_cumulative_sum, save_dir=EAG_savedir, save_filename='EAG_total_cumulative_sum.png')
+                    result_basedir = os.path.join(tra_dname, 'result')
+
+                total_indicator, evaluated_files = evaluate_track(track_context, tra_dname, result_basedir)
+                if total_indicator is not None:
+                    evaluated_nums = set(re.sub("\\D", "", tra_filename) for tra_filename in evaluated_files)
+                    evaluated_count = len(evaluated_nums & set(expected_nums))
+                    if evaluated_count < len(expected_nums):
+                        logger.warning('{} {} is incomplete, {}/{} files are evaluated and it is ranked after complete submissions'.format(
+                            team, track, evaluated_count, len(expected_nums)))
+                        print('{} {} is incomplete: {}/{} files are evaluated'.format(team, track, evaluated_count, len(expected_nums)))
+                    total_indicator.insert(0, 'expected_files', len(expected_nums))
+                    total_indicator.insert(0, 'evaluated_files', evaluated_count)
+                    total_indicator.insert(0, 'team', team)
+                    total_indicator.insert(0, 'track', track)
+                    total_indicators.append(total_indicator)
+
+            if total_indicators:
+                rankings.append(rank_submissions(total_indicators, args.rank_by or f'CE{args.CE_percentile}'))
+        else:
+            tra_dname = os.path.join(args.trajection_folder, track)
+            if args.save_folder:
+                result_basedir = os.path.join(args.save_folder, track)
+            else:
+                result_basedir = os.path.join(tra_dname, 'result')
+            evaluate_track(track_context, tra_dname, result_basedir)
 
         logger.debug('- {}, {} evaluation END -'.format(args.trajection_folder, track))
+
+    if rankings:
+        ranking = pd.concat(rankings, ignore_index=True)
+        utils.stdout_dataframe(ranking, title='leaderboard')
+        utils.save_csv(save_file=ranking, save_dir=args.save_folder or args.trajection_folder, save_filename='leaderboard.csv')
     
 if __name__ == '__main__':  
 
@@ -253,6 +1047,8 @@ if __name__ == '__main__':
     parser.add_argument('ground_truth_folder', type=str, help='Set ground truth folder name')
 
     parser.add_argument('--save_folder', type=str, help='Set save folder name')
+
+    parser.add_argument('--cache_folder', type=str, default=None, help='Set cache folder name for map-derived data and binary point data')
     
     parser.add_argument('--VDR', action='store_const', dest='track', default=['VDR','PDR'],
                         const=['VDR'],help='Set  VDR track')
@@ -283,6 +1079,10 @@ if __name__ == '__main__':
 
     parser.add_argument('--band_width', type=float, default=None, help='band width for kernel density')
 
+    parser.add_argument('--kde_fft', action='store_true', help='Calculate kernel density by binning and FFT convolution')
+
+    parser.add_argument('--kde_refine', action='store_true', help='Search kernel density mode from coarse to fine grid')
+
     parser.add_argument('--EAG', action='append_const', dest='indicators', default=[],
                         const='EAG', help='Calculate Error Accumulation Gradient')
 
@@ -300,14 +1100,60 @@ if __name__ == '__main__':
     parser.add_argument('--requirement_coverage', action='append_const', dest='indicators', default=[],
                         const='requirement_coverage', help='Calculate requirement for coverage')
 
+    parser.add_argument('--exact_total', action='store_true', help='Keep all values of total indicators regardless of exact_limit')
+
+    parser.add_argument('--exact_limit', type=int, default=1000000, 
+                        help='Number of values of each total indicator kept exactly before quantile sketch is used')
+
+    parser.add_argument('--sketch_size', type=int, default=200, help='Accuracy parameter of quantile sketch for total indicators')
+
+    parser.add_argument('--jobs', type=int, default=1, help='Number of processes to evaluate trajectory files in parallel')
+
+    parser.add_argument('--file_timeout', type=float, default=None, 
+                        help='Seconds to evaluate one trajectory file with --jobs, file which exceeds it fails')
+
+    parser.add_argument('--prefetch', type=int, default=0, help='Number of next trajectory files to load in background')
+
+    parser.add_argument('--plots', choices=['none', 'summary', 'all'], default='all', 
+                        help='Figures to draw, summary draws only total histgram and cumulative sum')
+
+    parser.add_argument('--plot_jobs', type=int, default=0, help='Number of processes to render figures in background')
+
+    parser.add_argument('--incremental', action='store_true', 
+                        help='Reuse results of files whose inputs are unchanged since last run')
+
+    parser.add_argument('--leaderboard', action='store_true', 
+                        help='Evaluate each subfolder of trajection folder as submission and rank them')
+
+    parser.add_argument('--rank_by', type=str, default=None, 
+                        help='Total indicator to rank submissions in leaderboard, CE with CE_percentile by default')
+
+    parser.add_argument('--shard', type=parse_shard, default=None, 
+                        help='Evaluate i-th of N shards of trajectory files as i/N and save it for merge command')
+
     parser.add_argument('--debug', action='store_const', dest='level', default=INFO, const=DEBUG, 
                         help='Logger debug mode')
 
-    args = parser.parse_args()
-    args.indicators = ['CE', 'CA', 'EAG', 'requirement_velocity', 'requirement_obstacle', 'requirement_coverage'] if not args.indicators else args.indicators
+    # Merge command combines results of --shard
+    merge_parser = argparse.ArgumentParser(prog='main.py merge', description='Merge shard results of XDR Challenge Evaluation')
+
+    merge_parser.add_argument('shard_files', nargs='+', help='Set shard result files saved by --shard')
+
+    merge_parser.add_argument('--save_folder', type=str, required=True, help='Set save folder name')
+
+    merge_parser.add_argument('--plots', choices=['none', 'summary', 'all'], default='all', 
+                              help='Figures to draw, total histgram and cumulative sum are drawn unless none')
+
+    merge_parser.add_argument('--debug', action='store_const', dest='level', default=INFO, const=DEBUG, 
+                              help='Logger debug mode')
+
+    if sys.argv[1:2] == ['merge']:
+        args = merge_parser.parse_args(sys.argv[2:])
+    else:
+        args = parser.parse_args()
+        args.indicators = ['CE', 'CA', 'EAG', 'requirement_velocity', 'requirement_obstacle', 'requirement_coverage'] if not args.indicators else args.indicators
     
     #　Logger setting
-    logger = getLogger(__name__)
     logger.setLevel(DEBUG)
 
     formatter = Formatter('%(asctime)s - %(name)s - %(message)s')
@@ -326,6 +1172,10 @@ if __name__ == '__main__':
     logger.addHandler(stream_handler)
     logger.addHandler(file_handler)
 
-    logger.debug('track:{}, indicators:{}'.format(args.track, args.indicators))
-    print('track:{}, indicators:{}'.format(args.track, args.indicators))
-    main(args)
+    if sys.argv[1:2] == ['merge']:
+        logger.debug('merge shard files:{}'.format(args.shard_files))
+        merge(args)
+    else:
+        logger.debug('track:{}, indicators:{}'.format(args.track, args.indicators))
+        print('track:{}, indicators:{}'.format(args.track, args.indicators))
+        main(args)
@@ -0,0 +1,122 @@
+# coding: utf-8
+import numpy as np
+
+
+class QuantileSketch(object):
+    '''
+    Mergeable quantile sketch of KLL type
+
+    Values are kept in levels, value at level h stands for 2**h original values.
+    When level exceeds its capacity, it is sorted and every other value is moved to next level.
+    Largest rank error is about 1.2 % of number of values with k=200 and 0.2 % with k=1000,
+    memory is about 3k values.
+    Sketch is exact until first compaction.
+
+    Parameters
+    ----------
+    k : int
+        capacity of top level, larger is more accurate
+    seed : int
+        seed to choose compaction offset, fixed for reproducible results
+    '''
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values):
+        '''
+        Add values to sketch
+
+        Parameters
+        ----------
+        values : array like of float
+            nan is ignored
+        '''
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.count += len(values)
+        self.compress()
+
+    def merge(self, other):
+        '''
+        Merge other sketch into this sketch
+
+        Parameters
+        ----------
+        other : QuantileSketch
+        '''
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self.compress()
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # Odd item stays, half of the others goes up with double weight
+                keep = items[:len(items) % 2]
+                items = items[len(items) % 2:]
+                offset = self.rng.integers(2)
+                self.levels[level] = keep
+                self.levels[level+1] = np.concatenate([self.levels[level+1], items[offset::2]])
+                # Capacity of lower levels depends on number of levels
+                level = 0
+                continue
+            level += 1
+
+    def weighted_items(self):
+        '''
+        Get sorted values in sketch and their weights
+
+        Returns
+        -------
+        values : ndarray of float
+        weights : ndarray of float
+        '''
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind='mergesort')
+        return values[order], weights[order]
+
+    def percentile(self, q):
+        '''
+        Estimate percentile by linear interpolation between ranks
+        Same as numpy.percentile while sketch is exact
+
+        Parameters
+        ----------
+        q : float
+            percentile between 0 and 100
+
+        Returns
+        -------
+        value : float
+            nan if sketch is empty
+        '''
+        if q < 0 or 100 < q:
+            raise ValueError('percentile shoud be between 0 and 100')
+        values, weights = self.weighted_items()
+        if len(values) == 0:
+            return np.nan
+
+        # Value at integer rank r is the item whose weight covers r
+        total_weight = weights.sum()
+        upper_rank = np.cumsum(weights) - 1
+        rank = q / 100 * (total_weight - 1)
+        lower_value = values[min(np.searchsorted(upper_rank, np.floor(rank)), len(values) - 1)]
+        upper_value = values[min(np.searchsorted(upper_rank, np.ceil(rank)), len(values) - 1)]
+        return lower_value + (upper_value - lower_value) * (rank - np.floor(rank))
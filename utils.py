@@ -1,5 +1,6 @@
 # coding: utf-8
 import os 
+import json
 import texttable
 
 import pandas as pd
@@ -30,9 +31,16 @@ def save_csv(save_file, save_dir, save_filename):
     save_file.to_csv(file_path)
     logger.debug('{} is saved at {}'.format(save_filename, file_path))
 
+def save_json(save_data, save_dir, save_filename):
+    file_path = os.path.join(save_dir, save_filename)
+    with open(file_path, 'w') as f:
+        json.dump(save_data, f)
+    logger.debug('{} is saved at {}'.format(save_filename, file_path))
+
 def create_dir(dir_path):
-    if not os.path.exists(dir_path):
+    # Directory may be created by another process at the same time
+    try:
         os.mkdir(dir_path)
         logger.debug('{} directory is created'.format(dir_path))
-    else:
+    except FileExistsError:
         logger.debug('{} directory already exists'.format(dir_path))
\ No newline at end of file